@@ -0,0 +1,140 @@
+import asyncio
+import functools
+import logging
+import queue
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import db
+import metrics
+
+# 🗄 Асинхронный доступ к БД: запись — в одном потоке через очередь, чтение — в пуле потоков
+READERS = 4
+GROUP_MAX = 64   # сколько записей из очереди склеивать в один коммит
+
+_jobs = queue.Queue()
+_writer = None
+_readers = None
+_lock = threading.Lock()
+
+# 📦 Групповой коммит: всё, что накопилось в очереди, выполняется одной транзакцией,
+# каждая задача — в своём SAVEPOINT, чтобы ошибка одной не откатывала остальные
+def _run_batch(batch):
+    results = []
+    try:
+        with db.transaction():
+            for fut, func, args, kwargs in batch:
+                try:
+                    with db.transaction():
+                        results.append((fut, True, func(*args, **kwargs)))
+                except Exception as e:
+                    logging.exception(f"[adb] Ошибка в {func.__name__}")
+                    results.append((fut, False, e))
+    except Exception as e:
+        logging.exception("[adb] Ошибка группового коммита")
+        results = [(fut, False, e) for fut, *_ in batch]
+    for fut, ok, value in results:
+        if ok:
+            fut.set_result(value)
+        else:
+            fut.set_exception(value)
+
+def _writer_loop():
+    db.use_connection(db.connect())
+    stopping = False
+    while not stopping:
+        batch = [_jobs.get()]
+        while len(batch) < GROUP_MAX and not _jobs.empty():
+            batch.append(_jobs.get_nowait())
+        if None in batch:
+            stopping = True
+            batch.remove(None)
+        batch = [job for job in batch if job[0].set_running_or_notify_cancel()]
+        if batch:
+            _run_batch(batch)
+
+def _init_reader():
+    db.use_connection(db.connect(readonly=True))
+
+def start():
+    global _writer, _readers
+    with _lock:
+        if _writer is None:
+            _writer = threading.Thread(target=_writer_loop, name="db-writer", daemon=True)
+            _writer.start()
+            _readers = ThreadPoolExecutor(READERS, thread_name_prefix="db-reader", initializer=_init_reader)
+
+def stop():
+    global _writer, _readers
+    with _lock:
+        if _writer is not None:
+            _jobs.put(None)
+            _writer.join()
+            _readers.shutdown()
+            _writer = _readers = None
+
+def _write(func):
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        start()
+        fut = Future()
+        with metrics.timed("bot_db_seconds", func=func.__name__):
+            _jobs.put((fut, func, args, kwargs))
+            return await asyncio.wrap_future(fut)
+    return wrapper
+
+def _read(func):
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        start()
+        loop = asyncio.get_running_loop()
+        with metrics.timed("bot_db_seconds", func=func.__name__):
+            return await loop.run_in_executor(_readers, functools.partial(func, *args, **kwargs))
+    return wrapper
+
+# ✍️ Запись
+add_user = _write(db.add_user)
+set_trial_used = _write(db.set_trial_used)
+update_until = _write(db.update_until)
+set_inactive = _write(db.set_inactive)
+update_balance = _write(db.update_balance)
+debit = _write(db.debit)
+purchase_subscription = _write(db.purchase_subscription)
+add_key = _write(db.add_key)
+add_keys = _write(db.add_keys)
+get_active_key = _write(db.get_active_key)
+expire_pool_keys = _write(db.expire_pool_keys)
+assign_key_to_user = _write(db.assign_key_to_user)
+mark_keys_checked = _write(db.mark_keys_checked)
+rotate_key = _write(db.rotate_key)
+save_endpoint_health = _write(db.save_endpoint_health)
+activate_trial = _write(db.activate_trial)
+delete_inactive_keys = _write(db.delete_inactive_keys)
+delete_stale_endpoint_health = _write(db.delete_stale_endpoint_health)
+deactivate_expired = _write(db.deactivate_expired)
+claim_expiry_reminders = _write(db.claim_expiry_reminders)
+compact_operations = _write(db.compact_operations)
+
+# 📖 Чтение
+get_user = _read(db.get_user)
+get_balance = _read(db.get_balance)
+get_pool_stats = _read(db.get_pool_stats)
+get_user_key = _read(db.get_user_key)
+is_user_active = _read(db.is_user_active)
+get_endpoint_health = _read(db.get_endpoint_health)
+existing_keys = _read(db.existing_keys)
+export_keys = _read(db.export_keys)
+get_user_operations = _read(db.get_user_operations)
+get_operations_page = _read(db.get_operations_page)
+get_operations_monthly = _read(db.get_operations_monthly)
+export_operations = _read(db.export_operations)
+reconcile_balances = _read(db.reconcile_balances)
+get_next_expiry = _read(db.get_next_expiry)
+get_due_key_checks = _read(db.get_due_key_checks)
+get_user_totals = _read(db.get_user_totals)
+get_daily_stats = _read(db.get_daily_stats)
+get_stats_totals = _read(db.get_stats_totals)
+get_all_users = _read(db.get_all_users)
+list_users = _read(db.list_users)
+find_users = _read(db.find_users)
+list_user_ids = _read(db.list_user_ids)
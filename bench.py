@@ -0,0 +1,270 @@
+# 🏋️ Нагрузочный тест бота без Telegram.
+#
+# Гоняет хендлеры main.py синтетическими апдейтами от N пользователей через фейковую
+# сессию Bot, на временной SQLite-базе с заданным наполнением. Источники ключей и
+# V2-серверы заменены локальным HTTP-сервером и TCP-листенерами.
+#
+#     python bench.py --users 200 --actions 20 --seed-users 50000
+#     python bench.py --compare bench_results/old.json
+#
+# Результат: пропускная способность и p50/p99 по хендлерам, функциям БД и этапам
+# парсера, плюс JSON-файл для сравнения прогонов.
+import argparse
+import asyncio
+import base64
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+MESSAGES = ["/start", "/profile", "👤 Личный кабинет", "/history", "🏠 Главное меню", "💳 Оплата"]
+CALLBACKS = ["install_v2", "update_key", "balance", "pay_with_balance", "sub_1m", "referrals"]
+ADMIN_USERNAME = "bench_admin"
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Нагрузочный тест бота")
+    p.add_argument("--users", type=int, default=100, help="одновременных пользователей")
+    p.add_argument("--actions", type=int, default=20, help="действий на пользователя")
+    p.add_argument("--seed-users", type=int, default=10000)
+    p.add_argument("--seed-ops", type=int, default=50000)
+    p.add_argument("--seed-keys", type=int, default=1000)
+    p.add_argument("--sources", type=int, default=4, help="страниц-источников на локальном HTTP")
+    p.add_argument("--links", type=int, default=200, help="ссылок на страницу")
+    p.add_argument("--endpoints", type=int, default=50, help="локальных TCP-серверов")
+    p.add_argument("--harvests", type=int, default=3, help="прогонов сбора ключей")
+    p.add_argument("--seed", type=int, default=1)
+    p.add_argument("--out", help="куда сохранить JSON (по умолчанию bench_results/<время>.json)")
+    p.add_argument("--compare", help="JSON прошлого прогона для сравнения")
+    return p.parse_args()
+
+# 🗄 Временная база и окружение — до импорта модулей бота
+def setup_env(workdir):
+    os.environ["DB_PATH"] = os.path.join(workdir, "bench.db")
+    os.environ["HTTP_CACHE_DIR"] = os.path.join(workdir, "http_cache")
+    os.environ["BOT_TOKEN"] = "123456:BENCHBENCHBENCHBENCHBENCHBENCHBENCH"
+    os.environ["ADMIN_USERNAME"] = ADMIN_USERNAME
+    os.environ.setdefault("ADMIN_ID", "1")
+
+def seed_db(db, args, rng):
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    with db.transaction() as conn:
+        conn.executemany(
+            "INSERT INTO users (user_id, username, balance, until, is_active, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+            [(i, f"user{i}", rng.randint(0, 3000), "2099-01-01" if i % 3 == 0 else None, int(i % 3 == 0), now)
+             for i in range(1, args.seed_users + 1)]
+        )
+        conn.executemany(
+            "INSERT INTO operations (user_id, type, amount, comment, date) VALUES (?, ?, ?, ?, ?)",
+            [(rng.randint(1, args.seed_users), "изменение", rng.randint(-300, 300), "bench", now)
+             for _ in range(args.seed_ops)]
+        )
+        conn.executemany(
+            "INSERT INTO keys (key, added_at, latency) VALUES (?, ?, ?)",
+            [(f"vless://seed-{i}@127.0.0.1:1", now, rng.random() * 100) for i in range(args.seed_keys)]
+        )
+
+# 🤖 Фейковая сессия Bot: отвечает на любой метод как Telegram, без сети
+def make_session():
+    from aiogram.client.session.base import BaseSession
+
+    class FakeSession(BaseSession):
+        async def make_request(self, bot, method, timeout=None):
+            name = type(method).__name__
+            if name in ("SendMessage", "EditMessageText", "SendDocument"):
+                result = {
+                    "message_id": 1, "date": int(time.time()),
+                    "chat": {"id": getattr(method, "chat_id", 1) or 1, "type": "private"},
+                    "text": getattr(method, "text", None) or "",
+                }
+            elif name == "GetMe":
+                result = {"id": 1, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+            else:
+                result = True
+            response = self.check_response(bot, method, 200, json.dumps({"ok": True, "result": result}))
+            return response.result
+
+        async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+            yield b""
+
+        async def close(self):
+            pass
+
+    return FakeSession()
+
+def make_update(update_id, user_id, action):
+    from aiogram.types import CallbackQuery, Chat, Message, Update, User
+
+    user = User(id=user_id, is_bot=False, first_name="bench", username=f"user{user_id}")
+    chat = Chat(id=user_id, type="private")
+    if action in CALLBACKS:
+        message = Message(message_id=1, date=datetime.now(), chat=chat, text="menu")
+        query = CallbackQuery(id=str(update_id), from_user=user, chat_instance="bench", data=action, message=message)
+        return Update(update_id=update_id, callback_query=query)
+    message = Message(message_id=update_id, date=datetime.now(), chat=chat, from_user=user, text=action)
+    return Update(update_id=update_id, message=message)
+
+# 🌐 Локальные источники ключей и V2-серверы
+async def start_fake_network(args, rng):
+    from aiohttp import web
+
+    servers = [await asyncio.start_server(lambda r, w: w.close(), "127.0.0.1", 0) for _ in range(args.endpoints)]
+    ports = [s.sockets[0].getsockname()[1] for s in servers]
+
+    def vmess(port, i):
+        data = {"add": "127.0.0.1", "port": str(port), "id": f"id-{i % 7}", "net": "tcp", "ps": f"remark {i}"}
+        return "vmess://" + base64.b64encode(json.dumps(data).encode()).decode()
+
+    pages = [
+        "\n".join(vmess(rng.choice(ports), rng.randint(0, 10 ** 6)) for _ in range(args.links))
+        for _ in range(args.sources)
+    ]
+
+    async def source(request):
+        etag = f'"{request.match_info["n"]}"'
+        if request.headers.get("If-None-Match") == etag:
+            return web.Response(status=304)
+        return web.Response(text=pages[int(request.match_info["n"])], headers={"ETag": etag})
+
+    app = web.Application()
+    app.router.add_get("/source/{n}", source)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    http_port = site._server.sockets[0].getsockname()[1]
+    os.environ["V2_SOURCES"] = ",".join(f"http://127.0.0.1:{http_port}/source/{n}" for n in range(args.sources))
+
+    async def stop():
+        await runner.cleanup()
+        for s in servers:
+            s.close()
+    return stop
+
+def summarize(samples):
+    samples = sorted(samples)
+    n = len(samples)
+    pick = lambda q: samples[min(n - 1, int(q * (n - 1) + 0.5))] * 1000
+    return {
+        "count": n,
+        "mean_ms": round(sum(samples) / n * 1000, 3),
+        "p50_ms": round(pick(0.5), 3),
+        "p99_ms": round(pick(0.99), 3),
+        "max_ms": round(samples[-1] * 1000, 3),
+    }
+
+def print_table(title, rows):
+    print(f"\n{title}")
+    print(f"{'':<28}{'count':>8}{'mean ms':>10}{'p50 ms':>10}{'p99 ms':>10}")
+    for name, s in sorted(rows.items(), key=lambda r: -r[1]["count"]):
+        print(f"{name:<28}{s['count']:>8}{s['mean_ms']:>10.2f}{s['p50_ms']:>10.2f}{s['p99_ms']:>10.2f}")
+
+def compare(old, new):
+    print("\nСравнение с прошлым прогоном (p99, мс):")
+    for group in ("handlers", "db", "parser"):
+        for name, s in sorted(new[group].items()):
+            before = old.get(group, {}).get(name)
+            if before:
+                delta = (s["p99_ms"] - before["p99_ms"]) / before["p99_ms"] * 100 if before["p99_ms"] else 0
+                label = f"{group}/{name}"
+                print(f"{label:<40}{before['p99_ms']:>10.2f} → {s['p99_ms']:<10.2f}{delta:+.0f}%")
+    print(f"throughput: {old.get('throughput_rps')} → {new['throughput_rps']} rps")
+
+async def run(args):
+    rng = random.Random(args.seed)
+    import adb
+    import db
+    import fetcher
+    import main
+    import metrics
+    import pool
+
+    samples = {}
+    observe = metrics.observe
+
+    def recording_observe(name, seconds, **labels):
+        label = labels.get("handler") or labels.get("func") or labels.get("result") or labels.get("status") or ""
+        samples.setdefault((name, label), []).append(seconds)
+        observe(name, seconds, **labels)
+
+    metrics.observe = recording_observe
+    main.bot.session = make_session()
+
+    seed_started = time.perf_counter()
+    seed_db(db, args, rng)
+    print(f"База заполнена за {time.perf_counter() - seed_started:.1f} с: "
+          f"{args.seed_users} пользователей, {args.seed_ops} операций, {args.seed_keys} ключей")
+
+    stop_network = await start_fake_network(args, rng)
+
+    # 🔥 Хендлеры
+    update_ids = iter(range(1, 10 ** 9))
+    user_ids = rng.sample(range(1, args.seed_users + 1), min(args.users, args.seed_users))
+    user_ids += [10 ** 9 + i for i in range(args.users - len(user_ids))]
+
+    async def simulate(user_id):
+        user_rng = random.Random(user_id)
+        await main.dp.feed_update(main.bot, make_update(next(update_ids), user_id, "/start"))
+        for _ in range(args.actions - 1):
+            action = user_rng.choice(MESSAGES + CALLBACKS)
+            await main.dp.feed_update(main.bot, make_update(next(update_ids), user_id, action))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(simulate(uid) for uid in user_ids))
+    elapsed = time.perf_counter() - started
+    total_updates = len(user_ids) * args.actions
+
+    # 🕸 Сбор ключей: холодный прогон, потом с условными запросами и кэшем здоровья
+    harvest_times = []
+    for _ in range(args.harvests):
+        t = time.perf_counter()
+        await pool.harvest(pool.POOL_HIGH)
+        harvest_times.append(time.perf_counter() - t)
+
+    await fetcher.close()
+    await stop_network()
+    adb.stop()
+
+    group = lambda metric: {label: summarize(v) for (name, label), v in samples.items() if name == metric and v}
+    parser_rows = {f"{name.removeprefix('bot_').removesuffix('_seconds')}:{label}": summarize(v)
+                   for (name, label), v in samples.items()
+                   if name in ("bot_fetch_seconds", "bot_probe_seconds", "bot_validate_seconds")}
+    parser_rows["harvest"] = summarize(harvest_times)
+    result = {
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "config": vars(args),
+        "python": sys.version.split()[0],
+        "updates": total_updates,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(total_updates / elapsed, 1),
+        "handlers": group("bot_handler_seconds"),
+        "db": group("bot_db_seconds"),
+        "parser": parser_rows,
+    }
+
+    print(f"\n{total_updates} апдейтов за {elapsed:.2f} с — {result['throughput_rps']} апдейтов/с")
+    print_table("Хендлеры", result["handlers"])
+    print_table("Функции БД", result["db"])
+    print_table("Парсер", result["parser"])
+    return result
+
+def bench():
+    args = parse_args()
+    with tempfile.TemporaryDirectory() as workdir:
+        setup_env(workdir)
+        result = asyncio.run(run(args))
+
+    out = args.out or os.path.join("bench_results", datetime.now().strftime("bench-%Y%m%d-%H%M%S.json"))
+    os.makedirs(os.path.dirname(out) or ".", exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(f"\nРезультат сохранён в {out}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            compare(json.load(f), result)
+
+if __name__ == "__main__":
+    bench()
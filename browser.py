@@ -0,0 +1,64 @@
+import html
+
+from aiogram.utils.keyboard import InlineKeyboardBuilder
+
+import adb
+
+# 📋 Постраничный просмотр пользователей для админа (keyset по user_id)
+PAGE_SIZE = 20
+
+FILTER_NAMES = {
+    "all": "все",
+    "active": "активные",
+    "expired": "истёкшие",
+    "key": "с ключом",
+    "ref": "рефералы",
+}
+
+def user_line(u):
+    return f"👤 {u.username} | id: {u.user_id} | ₿ {u.balance}₽ | до: {u.until or '-'}"
+
+# Фильтр в callback_data: "active" или "ref=123"
+def _parse_filter(raw):
+    name, _, arg = raw.partition("=")
+    if name not in FILTER_NAMES:
+        return "all", None
+    return name, int(arg) if name == "ref" and arg.isdigit() else None
+
+def _filter_token(name, arg):
+    return f"{name}={arg}" if name == "ref" else name
+
+# callback_data: users:<фильтр>:<next|prev>:<user_id>
+async def render_page(raw_filter="all", direction="next", cursor=0):
+    name, arg = _parse_filter(raw_filter)
+    if name == "ref" and arg is None:
+        name = "all"
+    if direction == "prev":
+        users, more_before = await adb.list_users(name, arg, before_id=cursor, limit=PAGE_SIZE)
+        more_after = True
+    else:
+        users, more_after = await adb.list_users(name, arg, after_id=cursor, limit=PAGE_SIZE)
+        more_before = cursor > 0
+
+    title = FILTER_NAMES[name] + (f" {arg}" if name == "ref" else "")
+    lines = "\n".join(user_line(u) for u in users)
+    text = f"<b>👥 Пользователи ({title}):</b>\n{lines or 'Нет пользователей.'}"
+
+    token = _filter_token(name, arg)
+    kb = InlineKeyboardBuilder()
+    nav = 0
+    if users and more_before:
+        kb.button(text="⬅️", callback_data=f"users:{token}:prev:{users[0].user_id}")
+        nav += 1
+    if users and more_after:
+        kb.button(text="➡️", callback_data=f"users:{token}:next:{users[-1].user_id}")
+        nav += 1
+    for key in ("all", "active", "expired", "key"):
+        kb.button(text=("• " if key == name else "") + FILTER_NAMES[key], callback_data=f"users:{key}:next:0")
+    kb.adjust(*([nav] if nav else []), 4)
+    return text, kb.as_markup()
+
+async def render_search(query):
+    users = await adb.find_users(query, limit=PAGE_SIZE)
+    lines = "\n".join(user_line(u) for u in users)
+    return f"<b>🔍 Поиск «{html.escape(query)}»:</b>\n{lines or 'Никого не найдено.'}"
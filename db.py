@@ -1,138 +1,687 @@
+import os
 import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
 from datetime import datetime
+from pathlib import Path
 
-conn = sqlite3.connect("database.db", check_same_thread=False)
-cursor = conn.cursor()
-
-# 🧾 Таблица пользователей
-cursor.execute('''
-CREATE TABLE IF NOT EXISTS users (
-    user_id INTEGER PRIMARY KEY,
-    username TEXT,
-    balance INTEGER DEFAULT 0,
-    referral_from INTEGER,
-    trial_used BOOLEAN DEFAULT 0,
-    until TEXT,
-    is_active BOOLEAN DEFAULT 0,
-    user_key TEXT
-)
-''')
-
-# 🔐 Таблица ключей
-cursor.execute('''
-CREATE TABLE IF NOT EXISTS keys (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    key TEXT,
-    active BOOLEAN DEFAULT 1
-)
-''')
-
-# 💳 Таблица истории операций
-cursor.execute('''
-CREATE TABLE IF NOT EXISTS operations (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    user_id INTEGER,
-    type TEXT,
-    amount INTEGER,
-    comment TEXT,
-    date TEXT
+import metrics
+import migrations
+
+DB_PATH = os.getenv("DB_PATH", "database.db")
+
+# ⚙️ Настройки соединения: WAL, чтобы чтение не ждало запись
+PRAGMAS = (
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-8000",
+    "PRAGMA temp_store=MEMORY",
 )
-''')
 
-conn.commit()
+CACHE_SIZE = 10000   # сколько пользователей держать в памяти
+CACHE_TTL = 0        # сек; 0 — без срока. Нужен, когда в базу пишут несколько процессов
+
+_local = threading.local()
+
+def connect(readonly=False):
+    if readonly:
+        uri = Path(DB_PATH).resolve().as_uri() + "?mode=ro"
+        conn = sqlite3.connect(uri, uri=True, check_same_thread=False, isolation_level=None)
+    else:
+        conn = sqlite3.connect(DB_PATH, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+# 🧵 У каждого потока своё соединение (пул потоков может выдать своё через use_connection)
+def use_connection(conn):
+    _local.conn = conn
+
+def _conn():
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = _local.conn = connect()
+    return conn
+
+def _cursor():
+    return _conn().cursor()
+
+# 🧾 Единица работы: всё внутри блока — один атомарный коммит.
+# Вложенные блоки становятся SAVEPOINT'ами, коммитит только внешний.
+@contextmanager
+def transaction():
+    conn = _conn()
+    depth = getattr(_local, "depth", 0)
+    if depth:
+        conn.execute(f"SAVEPOINT sp{depth}")
+    else:
+        conn.execute("BEGIN IMMEDIATE")
+    _local.depth = depth + 1
+    try:
+        yield conn
+    except BaseException:
+        _local.depth = depth
+        if depth:
+            conn.execute(f"ROLLBACK TO sp{depth}")
+            conn.execute(f"RELEASE sp{depth}")
+        else:
+            conn.execute("ROLLBACK")
+            _flush_invalidations()
+        raise
+    _local.depth = depth
+    if depth:
+        conn.execute(f"RELEASE sp{depth}")
+        return
+    try:
+        conn.execute("COMMIT")
+    except BaseException:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    finally:
+        _flush_invalidations()
+
+# 👤 Запись пользователя
+USER_FIELDS = ("user_id", "username", "balance", "referral_from", "trial_used", "until", "is_active", "user_key")
+USER_COLUMNS = ", ".join(USER_FIELDS)
+
+class User:
+    __slots__ = USER_FIELDS
+
+    def __init__(self, row):
+        for name, value in zip(USER_FIELDS, row):
+            setattr(self, name, value)
+
+    def __repr__(self):
+        return f"User({', '.join(f'{n}={getattr(self, n)!r}' for n in USER_FIELDS)})"
+
+# 🗃 LRU-кэш пользователей. Сбрасывается после коммита любой записи о пользователе;
+# _cache_gen не даёт читателю положить в кэш строку, прочитанную до этого коммита.
+# Чужие процессы кэш не сбрасывают — для них записи живут не дольше CACHE_TTL.
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+_cache_gen = 0
+cache_hits = 0
+cache_misses = 0
+
+def _cache_get(user_id):
+    global cache_hits, cache_misses
+    with _cache_lock:
+        entry = _cache.get(user_id)
+        if entry is None or (CACHE_TTL and time.monotonic() - entry[1] > CACHE_TTL):
+            cache_misses += 1
+            return None, _cache_gen
+        _cache.move_to_end(user_id)
+        cache_hits += 1
+        return entry[0], _cache_gen
+
+def _cache_put(user, gen):
+    with _cache_lock:
+        if gen != _cache_gen:
+            return
+        _cache[user.user_id] = (user, time.monotonic())
+        _cache.move_to_end(user.user_id)
+        if len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+
+# Пользователь изменился: внутри транзакции — сбросим после коммита, иначе сразу
+def _invalidate(*user_ids):
+    pending = getattr(_local, "pending", None)
+    if pending is None:
+        pending = _local.pending = set()
+    pending.update(user_ids)
+    if not getattr(_local, "depth", 0):
+        _flush_invalidations()
+
+def _flush_invalidations():
+    global _cache_gen
+    pending = getattr(_local, "pending", None)
+    if not pending:
+        return
+    with _cache_lock:
+        _cache_gen += 1
+        for user_id in pending:
+            _cache.pop(user_id, None)
+    pending.clear()
+
+def clear_cache():
+    global _cache_gen
+    with _cache_lock:
+        _cache_gen += 1
+        _cache.clear()
+
+@metrics.register_collector
+def _collect_cache():
+    size, hits, misses = cache_stats()
+    return [("bot_user_cache_size", {}, size), ("bot_user_cache_hits_total", {}, hits),
+            ("bot_user_cache_misses_total", {}, misses)]
+
+def cache_stats():
+    with _cache_lock:
+        return len(_cache), cache_hits, cache_misses
+
+# 🧬 Схема создаётся и обновляется миграциями
+def init_db():
+    return migrations.migrate(_conn())
+
+init_db()
+
+def _now():
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+# 📈 Дневной счётчик для статистики (пишется в той же транзакции, что и событие)
+def _bump(cursor, metric, value=1):
+    cursor.execute('''
+        INSERT INTO stats_daily (day, metric, value) VALUES (?, ?, ?)
+        ON CONFLICT (day, metric) DO UPDATE SET value = value + excluded.value
+    ''', (datetime.now().strftime("%Y-%m-%d"), metric, value))
 
 # ➕ Добавить пользователя (и начислить рефералу)
 def add_user(user_id, username, referral_from=None):
-    cursor.execute("SELECT * FROM users WHERE user_id=?", (user_id,))
-    if cursor.fetchone() is None:
-        cursor.execute("INSERT INTO users (user_id, username, referral_from) VALUES (?, ?, ?)",
-                       (user_id, username, referral_from))
-        conn.commit()
-        if referral_from and referral_from != user_id:
-            update_balance(referral_from, 100, "Реферал")
-        return True
-    return False
+    with transaction() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT * FROM users WHERE user_id=?", (user_id,))
+        if cursor.fetchone() is None:
+            cursor.execute("INSERT INTO users (user_id, username, referral_from, created_at) VALUES (?, ?, ?, ?)",
+                           (user_id, username, referral_from, _now()))
+            _invalidate(user_id)
+            _bump(cursor, "signups")
+            if referral_from and referral_from != user_id:
+                update_balance(referral_from, 100, "Реферал")
+            return True
+        return False
 
-# 👤 Получить пользователя
+# 👤 Получить пользователя (через кэш; внутри транзакции — всегда из БД)
 def get_user(user_id):
-    cursor.execute("SELECT * FROM users WHERE user_id=?", (user_id,))
-    return cursor.fetchone()
+    in_transaction = getattr(_local, "depth", 0)
+    if not in_transaction:
+        user, gen = _cache_get(user_id)
+        if user is not None:
+            return user
+    cursor = _cursor()
+    cursor.execute(f"SELECT {USER_COLUMNS} FROM users WHERE user_id=?", (user_id,))
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    user = User(row)
+    if not in_transaction:
+        _cache_put(user, gen)
+    return user
 
 # ✅ Пробник использован
 def set_trial_used(user_id):
+    cursor = _cursor()
     cursor.execute("UPDATE users SET trial_used=1 WHERE user_id=?", (user_id,))
-    conn.commit()
+    _invalidate(user_id)
 
 # ⏳ Обновить подписку
 def update_until(user_id, until_date):
+    cursor = _cursor()
     cursor.execute("UPDATE users SET until=?, is_active=1 WHERE user_id=?", (until_date, user_id))
-    conn.commit()
+    _invalidate(user_id)
 
 # ❌ Отключить подписку
 def set_inactive(user_id):
+    cursor = _cursor()
     cursor.execute("UPDATE users SET is_active=0 WHERE user_id=?", (user_id,))
-    conn.commit()
+    _invalidate(user_id)
 
 # 💸 Баланс
-def update_balance(user_id, amount, comment=""):
-    cursor.execute("UPDATE users SET balance = balance + ? WHERE user_id=?", (amount, user_id))
-    cursor.execute('''
-        INSERT INTO operations (user_id, type, amount, comment, date)
-        VALUES (?, ?, ?, ?, ?)
-    ''', (user_id, "изменение", amount, comment, datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
-    conn.commit()
+def update_balance(user_id, amount, comment="", op_type="изменение"):
+    with transaction() as conn:
+        cursor = conn.cursor()
+        cursor.execute("UPDATE users SET balance = balance + ? WHERE user_id=?", (amount, user_id))
+        cursor.execute('''
+            INSERT INTO operations (user_id, type, amount, comment, date)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (user_id, op_type, amount, comment, _now()))
+        _invalidate(user_id)
+
+# ➖ Списание, только если хватает денег: проверка и списание — один UPDATE,
+# так что параллельные процессы не уведут баланс в минус. None — не хватило
+def debit(user_id, amount, comment="", op_type="списание"):
+    with transaction() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "UPDATE users SET balance = balance - ? WHERE user_id=? AND balance >= ? RETURNING balance",
+            (amount, user_id, amount)
+        )
+        rows = cursor.fetchall()
+        if not rows:
+            return None
+        cursor.execute('''
+            INSERT INTO operations (user_id, type, amount, comment, date)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (user_id, op_type, -amount, comment, _now()))
+        _invalidate(user_id)
+        return rows[0][0]
+
+# 🛒 Покупка подписки: списание и продление одним коммитом (None — недостаточно средств)
+def purchase_subscription(user_id, price, until_date, comment, days):
+    with transaction() as conn:
+        balance = debit(user_id, price, comment, "подписка")
+        if balance is None:
+            return None
+        update_until(user_id, until_date)
+        cursor = conn.cursor()
+        _bump(cursor, "payments")
+        _bump(cursor, "revenue", price)
+        _bump(cursor, f"revenue:{days}", price)
+        return balance
 
 def get_balance(user_id):
-    cursor.execute("SELECT balance FROM users WHERE user_id=?", (user_id,))
-    result = cursor.fetchone()
-    return result[0] if result else 0
+    user = get_user(user_id)
+    return user.balance if user else 0
 
 # 🔑 Ключи
 def add_key(key):
-    cursor.execute("INSERT INTO keys (key) VALUES (?)", (key,))
-    conn.commit()
-
-def get_active_key():
-    cursor.execute("SELECT key FROM keys WHERE active=1 LIMIT 1")
-    result = cursor.fetchone()
-    if result:
-        cursor.execute("UPDATE keys SET active=0 WHERE key=?", (result[0],))
-        conn.commit()
-        return result[0]
-    return None
+    cursor = _cursor()
+    cursor.execute("INSERT OR IGNORE INTO keys (key, added_at) VALUES (?, ?)", (key, _now()))
+
+# keys — пары (ключ, задержка в мс); уже известные ключи пропускаются
+def add_keys(keys, imported=False):
+    now = _now()
+    with transaction() as conn:
+        cursor = conn.executemany("INSERT OR IGNORE INTO keys (key, added_at, latency, imported) VALUES (?, ?, ?, ?)",
+                                  [(k, now, latency, imported) for k, latency in keys])
+        return cursor.rowcount
+
+# Забирает самый быстрый ключ из пула одним запросом (не старше fresh_after, если задано;
+# импортированные админом выдаются независимо от возраста)
+def get_active_key(fresh_after=None):
+    cursor = _cursor()
+    cursor.execute('''
+        UPDATE keys SET active=0
+        WHERE id = (
+            SELECT id FROM keys
+            WHERE active=1 AND (? IS NULL OR added_at >= ? OR imported=1)
+            ORDER BY latency IS NULL, latency, id
+            LIMIT 1
+        )
+        RETURNING key
+    ''', (fresh_after, fresh_after))
+    result = cursor.fetchall()
+    return result[0][0] if result else None
+
+# 🔋 Пул: размер, самый старый и самый свежий ключ
+def get_pool_stats():
+    cursor = _cursor()
+    cursor.execute("SELECT COUNT(*), MIN(added_at), MAX(added_at) FROM keys WHERE active=1")
+    return cursor.fetchone()
+
+# Удаляет из пула ключи, добавленные раньше older_than (кроме импортированных админом)
+def expire_pool_keys(older_than):
+    cursor = _cursor()
+    cursor.execute("DELETE FROM keys WHERE active=1 AND imported=0 AND (added_at IS NULL OR added_at < ?)", (older_than,))
+    return cursor.rowcount
+
+# Какие из ключей уже есть в таблице (в пуле или выданы) — по уникальному индексу
+def existing_keys(keys):
+    keys = list(keys)
+    cursor = _cursor()
+    found = set()
+    for i in range(0, len(keys), 500):
+        chunk = keys[i:i + 500]
+        cursor.execute(f"SELECT key FROM keys WHERE key IN ({','.join('?' * len(chunk))})", chunk)
+        found.update(row[0] for row in cursor)
+    return found
+
+# 📤 Свободные ключи пула по порядку id, пачками: [(id, key, latency, added_at)]
+def export_keys(after_id=0, limit=5000):
+    cursor = _cursor()
+    cursor.execute('''
+        SELECT id, key, latency, added_at FROM keys
+        WHERE active=1 AND id > ? ORDER BY id LIMIT ?
+    ''', (after_id, limit))
+    return cursor.fetchall()
+
+# 🩺 Здоровье серверов: {endpoint: (ok, latency, failures, next_probe_at)}
+def get_endpoint_health(endpoints):
+    endpoints = list(endpoints)
+    cursor = _cursor()
+    health = {}
+    for i in range(0, len(endpoints), 500):
+        chunk = endpoints[i:i + 500]
+        cursor.execute(f'''
+            SELECT endpoint, ok, latency, failures, next_probe_at FROM endpoint_health
+            WHERE endpoint IN ({",".join("?" * len(chunk))})
+        ''', chunk)
+        health.update((row[0], row[1:]) for row in cursor)
+    return health
+
+# rows — (endpoint, ok, latency, checked_at, failures, next_probe_at)
+def save_endpoint_health(rows):
+    with transaction() as conn:
+        conn.executemany("INSERT OR REPLACE INTO endpoint_health VALUES (?, ?, ?, ?, ?, ?)", rows)
 
 def assign_key_to_user(user_id, key):
-    cursor.execute("UPDATE users SET user_key=? WHERE user_id=?", (key, user_id))
-    conn.commit()
+    cursor = _cursor()
+    cursor.execute("UPDATE users SET user_key=?, key_checked_at=NULL WHERE user_id=?", (key, user_id))
+    _invalidate(user_id)
+
+# 🩺 Ключи активных пользователей, которые пора перепроверить: давно проверенные первыми
+def get_due_key_checks(checked_before, limit):
+    cursor = _cursor()
+    cursor.execute('''
+        SELECT user_id, user_key FROM users
+        WHERE is_active=1 AND (key_checked_at IS NULL OR key_checked_at < ?)
+              AND user_key IS NOT NULL AND user_key != ''
+        ORDER BY key_checked_at
+        LIMIT ?
+    ''', (checked_before, limit))
+    return cursor.fetchall()
+
+def mark_keys_checked(user_ids, checked_at):
+    with transaction() as conn:
+        conn.executemany("UPDATE users SET key_checked_at=? WHERE user_id=?", [(checked_at, u) for u in user_ids])
+
+# ♻️ Замена ключа: свежий ключ из пула, если у пользователя всё ещё old_key.
+# Забор из пула и запись — один коммит; None — пул пуст или ключ уже сменился
+def rotate_key(user_id, old_key, fresh_after=None):
+    with transaction() as conn:
+        key = get_active_key(fresh_after)
+        if key is None:
+            return None
+        cursor = conn.execute(
+            "UPDATE users SET user_key=?, key_checked_at=NULL WHERE user_id=? AND user_key=?",
+            (key, user_id, old_key)
+        )
+        if cursor.rowcount == 0:
+            conn.execute("UPDATE keys SET active=1 WHERE key=?", (key,))
+            return None
+        _invalidate(user_id)
+        return key
+
+# 🧪 Выдача пробника: срок, отметка и ключ одним коммитом. Флаг ставится условным UPDATE,
+# поэтому пробник выдаётся один раз; при повторе ключ возвращается в пул (False)
+def activate_trial(user_id, until_date, key):
+    with transaction() as conn:
+        cursor = conn.execute("UPDATE users SET trial_used=1 WHERE user_id=? AND trial_used=0", (user_id,))
+        if cursor.rowcount == 0:
+            conn.execute("UPDATE keys SET active=1 WHERE key=?", (key,))
+            return False
+        _invalidate(user_id)
+        update_until(user_id, until_date)
+        assign_key_to_user(user_id, key)
+        return True
 
 def get_user_key(user_id):
-    cursor.execute("SELECT user_key FROM users WHERE user_id=?", (user_id,))
-    result = cursor.fetchone()
-    return result[0] if result else None
+    user = get_user(user_id)
+    return user.user_key if user else None
 
-# 📦 Очистка неактивных ключей
-def delete_inactive_keys():
-    cursor.execute("DELETE FROM keys WHERE active=0")
-    conn.commit()
+# 📦 Очистка неактивных ключей: не больше limit строк за вызов, чтобы не держать запись долго.
+# Ключи, которые сейчас у пользователей, остаются — по ним existing_keys не даёт собрать их повторно
+def delete_inactive_keys(limit=1000):
+    cursor = _cursor()
+    cursor.execute('''
+        DELETE FROM keys WHERE id IN (
+            SELECT id FROM keys
+            WHERE active=0 AND key NOT IN (SELECT user_key FROM users WHERE user_key IS NOT NULL)
+            LIMIT ?
+        )
+    ''', (limit,))
+    return cursor.rowcount
+
+# То же для записей о здоровье серверов, не проверявшихся с before (unix time)
+def delete_stale_endpoint_health(before, limit=1000):
+    cursor = _cursor()
+    cursor.execute('''
+        DELETE FROM endpoint_health
+        WHERE endpoint IN (SELECT endpoint FROM endpoint_health WHERE checked_at < ? LIMIT ?)
+    ''', (before, limit))
+    return cursor.rowcount
+
+# ⛔ Отключает всех, у кого подписка закончилась раньше today (YYYY-MM-DD), одним UPDATE
+def deactivate_expired(today):
+    cursor = _cursor()
+    cursor.execute("UPDATE users SET is_active=0 WHERE is_active=1 AND until < ? RETURNING user_id", (today,))
+    user_ids = [row[0] for row in cursor.fetchall()]
+    _invalidate(*user_ids)
+    return len(user_ids)
+
+# ⏰ Ближайшая дата окончания среди активных (по индексу is_active, until)
+def get_next_expiry():
+    cursor = _cursor()
+    cursor.execute("SELECT MIN(until) FROM users WHERE is_active=1")
+    return cursor.fetchone()[0]
+
+# 🔔 Кому напомнить: подписка заканчивается в day, напоминания ещё не было.
+# Сразу помечает их, чтобы не напомнить дважды. Возвращает [user_id]
+def claim_expiry_reminders(day):
+    cursor = _cursor()
+    cursor.execute('''
+        UPDATE users SET reminded_until = until
+        WHERE is_active=1 AND until = ? AND reminded_until IS NOT until
+        RETURNING user_id
+    ''', (day,))
+    return [row[0] for row in cursor.fetchall()]
 
 # ✅ Проверка активности
 def is_user_active(user_id):
-    cursor.execute("SELECT is_active FROM users WHERE user_id=?", (user_id,))
-    result = cursor.fetchone()
-    return result[0] == 1 if result else False
+    user = get_user(user_id)
+    return user.is_active == 1 if user else False
 
-# 📊 Операции
+# 📊 Операции пользователя страницами по id, новые сверху: старше before_id или новее after_id.
+# Возвращает ([(id, type, amount, comment, date)], есть_ли_ещё_в_этом_направлении)
+def get_operations_page(user_id, before_id=None, after_id=None, limit=20):
+    if after_id is not None:
+        where, order, cursor_id = "id > ?", "ASC", after_id
+    else:
+        where, order, cursor_id = "id < ?", "DESC", before_id if before_id is not None else 2 ** 63 - 1
+    cursor = _cursor()
+    cursor.execute(f'''
+        SELECT id, type, amount, comment, date
+        FROM operations
+        WHERE user_id=? AND {where}
+        ORDER BY id {order}
+        LIMIT ?
+    ''', (user_id, cursor_id, limit + 1))
+    rows = cursor.fetchall()
+    more = len(rows) > limit
+    rows = rows[:limit]
+    if order == "ASC":
+        rows.reverse()
+    return rows, more
+
+# Последние 20 операций [(type, amount, comment, date)] — прежний API, поверх страниц
 def get_user_operations(user_id):
+    rows, _ = get_operations_page(user_id, limit=20)
+    return [row[1:] for row in rows]
+
+# 🗄 Сжатые операции пользователя: [(month, type, amount, count)], свежие месяцы сверху
+def get_operations_monthly(user_id, limit=12):
+    cursor = _cursor()
     cursor.execute('''
-        SELECT type, amount, comment, date
-        FROM operations
-        WHERE user_id=?
-        ORDER BY id DESC
-        LIMIT 20
-    ''', (user_id,))
+        SELECT month, type, amount, count FROM operations_monthly
+        WHERE user_id=? ORDER BY month DESC, type LIMIT ?
+    ''', (user_id, limit))
+    return cursor.fetchall()
+
+# 📤 Операции для выгрузки по порядку id, пачками (всех или одного пользователя)
+def export_operations(after_id=0, limit=5000, user_id=None):
+    cursor = _cursor()
+    if user_id is None:
+        cursor.execute('''
+            SELECT id, user_id, type, amount, comment, date FROM operations
+            WHERE id > ? ORDER BY id LIMIT ?
+        ''', (after_id, limit))
+    else:
+        cursor.execute('''
+            SELECT id, user_id, type, amount, comment, date FROM operations
+            WHERE user_id=? AND id > ? ORDER BY id LIMIT ?
+        ''', (user_id, after_id, limit))
     return cursor.fetchall()
 
+# 🗜 Сжатие журнала: до chunk самых старых операций раньше cutoff (YYYY-MM-DD) уходят в
+# помесячные итоги, их сумма добавляется к снимку баланса. Возвращает, сколько строк сжато
+def compact_operations(cutoff, chunk=5000):
+    with transaction() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT MAX(id) FROM (SELECT id FROM operations WHERE date < ? ORDER BY id LIMIT ?)",
+                       (cutoff, chunk))
+        through_id = cursor.fetchone()[0]
+        if through_id is None:
+            return 0
+        scope = "FROM operations WHERE id <= ? AND date < ?"
+        cursor.execute(f'''
+            INSERT INTO operations_monthly (user_id, month, type, amount, count)
+            SELECT user_id, substr(date, 1, 7), type, SUM(amount), COUNT(*) {scope} GROUP BY 1, 2, 3
+            ON CONFLICT (user_id, month, type) DO UPDATE SET
+                amount = amount + excluded.amount, count = count + excluded.count
+        ''', (through_id, cutoff))
+        cursor.execute(f'''
+            INSERT INTO balance_snapshots (user_id, balance, through_id, taken_at)
+            SELECT user_id, SUM(amount), ?, ? {scope} GROUP BY user_id
+            ON CONFLICT (user_id) DO UPDATE SET
+                balance = balance + excluded.balance, through_id = excluded.through_id, taken_at = excluded.taken_at
+        ''', (through_id, _now(), through_id, cutoff))
+        cursor.execute(f"DELETE {scope}", (through_id, cutoff))
+        return cursor.rowcount
+
+# ⚖️ Сверка: users.balance должен равняться снимку плюс сумме несжатых операций.
+# Возвращает (число расхождений, [(user_id, balance, по_журналу)] первых limit)
+def reconcile_balances(limit=20):
+    cursor = _cursor()
+    cursor.execute('''
+        WITH ledger AS (
+            SELECT user_id, SUM(amount) AS amount FROM (
+                SELECT user_id, balance AS amount FROM balance_snapshots
+                UNION ALL
+                SELECT user_id, amount FROM operations
+            ) GROUP BY user_id
+        )
+        SELECT u.user_id, u.balance, COALESCE(l.amount, 0) FROM users u
+        LEFT JOIN ledger l ON l.user_id = u.user_id
+        WHERE COALESCE(u.balance, 0) != COALESCE(l.amount, 0)
+        ORDER BY u.user_id
+    ''')
+    rows = cursor.fetchall()
+    return len(rows), rows[:limit]
+
 # 👥 Все пользователи
 def get_all_users():
-    cursor.execute("SELECT * FROM users")
+    cursor = _cursor()
+    cursor.execute(f"SELECT {USER_COLUMNS} FROM users")
+    return [User(row) for row in cursor]
+
+# 📊 Итоги по пользователям одним запросом: всего, активных, с ключом, сумма балансов
+def get_user_totals():
+    cursor = _cursor()
+    cursor.execute('''
+        SELECT COUNT(*),
+               COALESCE(SUM(is_active = 1), 0),
+               COALESCE(SUM(user_key IS NOT NULL AND user_key != ''), 0),
+               COALESCE(SUM(balance), 0)
+        FROM users
+    ''')
+    return cursor.fetchone()
+
+# 📈 Дневные счётчики начиная с since_day: [(day, metric, value)]
+def get_daily_stats(since_day):
+    cursor = _cursor()
+    cursor.execute("SELECT day, metric, value FROM stats_daily WHERE day >= ? ORDER BY day", (since_day,))
     return cursor.fetchall()
+
+# 📈 Счётчики за всё время: {metric: value}
+def get_stats_totals():
+    cursor = _cursor()
+    cursor.execute("SELECT metric, SUM(value) FROM stats_daily GROUP BY metric")
+    return dict(cursor.fetchall())
+
+# 🔎 Фильтры для просмотра пользователей
+USER_FILTERS = {
+    "all": "1",
+    "active": "is_active = 1",
+    "expired": "is_active = 0 AND until IS NOT NULL",
+    "key": "user_key IS NOT NULL AND user_key != ''",
+    "ref": "referral_from = ?",
+}
+
+# 📄 Страница пользователей по ключу user_id: после after_id или до before_id.
+# Возвращает (пользователи, есть_ли_ещё_в_этом_направлении)
+def list_users(filter_name="all", filter_arg=None, after_id=None, before_id=None, limit=20):
+    where = [USER_FILTERS[filter_name]]
+    params = [filter_arg] if filter_name == "ref" else []
+    if before_id is not None:
+        where.append("user_id < ?")
+        params.append(before_id)
+        order = "DESC"
+    else:
+        where.append("user_id > ?")
+        params.append(after_id or 0)
+        order = "ASC"
+    cursor = _cursor()
+    cursor.execute(f'''
+        SELECT {USER_COLUMNS} FROM users
+        WHERE {" AND ".join(where)}
+        ORDER BY user_id {order}
+        LIMIT ?
+    ''', (*params, limit + 1))
+    users = [User(row) for row in cursor]
+    more = len(users) > limit
+    users = users[:limit]
+    if order == "DESC":
+        users.reverse()
+    return users, more
+
+# 🆔 id пользователей по порядку, страницами (для рассылки)
+def list_user_ids(after_id=0, limit=1000):
+    cursor = _cursor()
+    cursor.execute("SELECT user_id FROM users WHERE user_id > ? ORDER BY user_id LIMIT ?", (after_id, limit))
+    return [row[0] for row in cursor]
+
+# 🔍 Поиск по id или началу username (по индексу)
+def find_users(query, limit=20):
+    cursor = _cursor()
+    query = query.lstrip("@")
+    if query.isdigit():
+        cursor.execute(f"SELECT {USER_COLUMNS} FROM users WHERE user_id = ?", (int(query),))
+    else:
+        pattern = query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        cursor.execute(
+            f"SELECT {USER_COLUMNS} FROM users WHERE username LIKE ? ESCAPE '\\' ORDER BY username COLLATE NOCASE LIMIT ?",
+            (pattern, limit)
+        )
+    return [User(row) for row in cursor]
+
+# 🧰 Обслуживание. Вызывается на отдельном потоке со своим соединением, вне транзакций
+
+# Перенос WAL в основной файл: PASSIVE не ждёт читателей, TRUNCATE ещё и обнуляет WAL.
+# Возвращает (busy, страниц в WAL, перенесено)
+def checkpoint(mode="PASSIVE"):
+    return _conn().execute(f"PRAGMA wal_checkpoint({mode})").fetchone()
+
+# Статистика для планировщика запросов: полный ANALYZE, если её ещё нет, дальше — ANALYZE
+# по выборке из analysis_limit строк на индекс. PRAGMA optimize тут не годится: он пересчитывает
+# только таблицы, которые читало это же соединение, а соединение обслуживания запросов не делает
+def optimize(analysis_limit=1000):
+    conn = _conn()
+    has_stats = conn.execute("SELECT 1 FROM sqlite_master WHERE name='sqlite_stat1'").fetchone()
+    conn.execute(f"PRAGMA analysis_limit={int(analysis_limit) if has_stats else 0}")
+    conn.execute("ANALYZE")
+
+# 💾 Согласованная копия базы через backup API: одним шагом, в WAL это не блокирует запись
+def backup_to(path):
+    target = sqlite3.connect(path)
+    try:
+        _conn().backup(target)
+    finally:
+        target.close()
+
+# 📏 Размер файла и WAL в байтах, страницы, свободные страницы (фрагментация)
+def db_info():
+    conn = _conn()
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+    freelist = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    wal = DB_PATH + "-wal"
+    return {
+        "file_bytes": os.path.getsize(DB_PATH),
+        "wal_bytes": os.path.getsize(wal) if os.path.exists(wal) else 0,
+        "page_size": page_size,
+        "pages": page_count,
+        "free_pages": freelist,
+    }
@@ -0,0 +1,52 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+
+import adb
+import outbox
+
+# ⏰ Планировщик окончания подписок.
+# until хранится как YYYY-MM-DD: строки сортируются как даты, подписка действует весь день until.
+RECHECK = 3600          # не спать дольше часа: могли появиться новые подписки
+
+next_due = None         # когда в следующий раз что-то закончится (в памяти)
+
+def _today():
+    return datetime.today().strftime("%Y-%m-%d")
+
+# ⛔ Отключает истёкшие подписки одним UPDATE, возвращает сколько отключено
+async def expire_now():
+    count = await adb.deactivate_expired(_today())
+    if count:
+        logging.info(f"[expiry] Отключено подписок: {count}")
+    return count
+
+# 🔔 Напоминания тем, у кого сегодня последний день (через очередь outbox)
+async def send_reminders():
+    user_ids = await adb.claim_expiry_reminders(_today())
+    for user_id in user_ids:
+        outbox.send(user_id, "⏳ Подписка закончится через 24 часа. Продли её в разделе «💳 Оплата».", priority=outbox.BULK)
+    return len(user_ids)
+
+# Подписка с until = D действует до конца D: напоминание в начале D, отключение в начале D+1
+async def _refresh_next_due():
+    global next_due
+    until = await adb.get_next_expiry()
+    if until is None:
+        next_due = None
+        return
+    day = datetime.strptime(until, "%Y-%m-%d")
+    next_due = day if day > datetime.now() else day + timedelta(days=1)
+
+async def expiry_loop():
+    while True:
+        try:
+            await expire_now()
+            await send_reminders()
+            await _refresh_next_due()
+        except Exception:
+            logging.exception("[expiry] Ошибка планировщика")
+        delay = RECHECK
+        if next_due is not None:
+            delay = min(RECHECK, max(1, (next_due - datetime.now()).total_seconds()))
+        await asyncio.sleep(delay)
@@ -0,0 +1,121 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+
+import aiofiles
+import aiohttp
+
+import metrics
+from parser import SOURCES
+
+# 🌐 Асинхронная загрузка источников: все сразу, с условными запросами и кэшем на диске
+FETCH_TIMEOUT = 5
+CACHE_DIR = os.getenv("HTTP_CACHE_DIR", "http_cache")
+BACKOFF_BASE = 60            # первая пауза после ошибки, сек
+BACKOFF_MAX = 6 * 3600       # максимальная пауза, сек
+HEADERS = {"User-Agent": "Mozilla/5.0"}
+
+_session = None
+_backoff = {}                # url -> (ошибок подряд, не раньше чем)
+
+# 📌 Источники: V2_SOURCES (через запятую или перевод строки), иначе sources.txt, иначе parser.SOURCES
+def load_sources():
+    raw = os.getenv("V2_SOURCES")
+    if raw is None and os.path.exists("sources.txt"):
+        with open("sources.txt", encoding="utf-8") as f:
+            raw = f.read()
+    if raw is None:
+        return list(SOURCES)
+    urls = [u.strip() for u in raw.replace(",", "\n").splitlines()]
+    return [u for u in urls if u and not u.startswith("#")]
+
+def get_session():
+    global _session
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession(
+            headers=HEADERS,
+            timeout=aiohttp.ClientTimeout(total=FETCH_TIMEOUT),
+            connector=aiohttp.TCPConnector(limit=32, ttl_dns_cache=300),
+        )
+    return _session
+
+async def close():
+    if _session is not None and not _session.closed:
+        await _session.close()
+
+# 💾 Кэш ответа: <sha1>.json (ETag, Last-Modified) + <sha1>.body
+def _cache_path(url, cache_dir):
+    return os.path.join(cache_dir, hashlib.sha1(url.encode()).hexdigest())
+
+async def _read_cache(url, cache_dir):
+    path = _cache_path(url, cache_dir)
+    try:
+        async with aiofiles.open(path + ".json", encoding="utf-8") as f:
+            meta = json.loads(await f.read())
+        async with aiofiles.open(path + ".body", encoding="utf-8") as f:
+            return meta, await f.read()
+    except (OSError, ValueError):
+        return {}, None
+
+async def _write_cache(url, cache_dir, meta, body):
+    os.makedirs(cache_dir, exist_ok=True)
+    path = _cache_path(url, cache_dir)
+    async with aiofiles.open(path + ".body", "w", encoding="utf-8") as f:
+        await f.write(body)
+    async with aiofiles.open(path + ".json", "w", encoding="utf-8") as f:
+        await f.write(json.dumps(meta))
+
+def _fail(url):
+    failures = _backoff.get(url, (0, 0))[0] + 1
+    delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (failures - 1))
+    _backoff[url] = (failures, time.time() + delay)
+    return delay
+
+# 📥 Один источник: текст страницы (из сети или из кэша) или None
+async def fetch_source(url, session=None, cache_dir=CACHE_DIR):
+    meta, cached = await _read_cache(url, cache_dir)
+    if time.time() < _backoff.get(url, (0, 0))[1]:
+        return cached
+
+    headers = {}
+    if cached is not None:
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+
+    started = time.perf_counter()
+    try:
+        async with (session or get_session()).get(url, headers=headers) as r:
+            if r.status == 304 and cached is not None:
+                _backoff.pop(url, None)
+                metrics.observe("bot_fetch_seconds", time.perf_counter() - started, source=url, status="304")
+                return cached
+            r.raise_for_status()
+            body = await r.text(errors="ignore")
+            meta = {
+                "etag": r.headers.get("ETag"),
+                "last_modified": r.headers.get("Last-Modified"),
+                "fetched_at": time.time(),
+            }
+    except Exception as e:
+        metrics.observe("bot_fetch_seconds", time.perf_counter() - started, source=url, status="error")
+        delay = _fail(url)
+        logging.warning(f"[fetcher] Ошибка при получении {url}: {e!r}, пауза {delay} сек")
+        return cached
+
+    metrics.observe("bot_fetch_seconds", time.perf_counter() - started, source=url, status="200")
+    _backoff.pop(url, None)
+    await _write_cache(url, cache_dir, meta, body)
+    return body
+
+# 🌊 Страницы по мере загрузки (быстрые источники не ждут медленных)
+async def iter_pages(sources=None, session=None, cache_dir=CACHE_DIR):
+    sources = load_sources() if sources is None else sources
+    for next_page in asyncio.as_completed([fetch_source(url, session, cache_dir) for url in sources]):
+        page = await next_page
+        if page:
+            yield page
@@ -1,11 +1,59 @@
-from flask import Flask
-from threading import Thread
+import hmac
+import os
 
-app = Flask(__name__)
+from aiohttp import web
 
-@app.route('/')
-def home():
-    return "Bot is running!"
+import adb
+import metrics
 
-def keep_alive():
-    Thread(target=app.run, kwargs={'host': '0.0.0.0', 'port': 8080}).start()
+# 🌐 Один aiohttp-сервер в цикле бота: health-check, вебхук Telegram и админские эндпоинты
+HOST = "0.0.0.0"
+PORT = int(os.getenv("PORT", "8080"))
+ADMIN_HTTP_TOKEN = os.getenv("ADMIN_HTTP_TOKEN")
+
+async def home(request):
+    return web.Response(text="Bot is running!")
+
+# 📈 Метрики в формате Prometheus
+async def metrics_handler(request):
+    return web.Response(text=metrics.render(), content_type="text/plain", charset="utf-8")
+
+# 🔐 Админские эндпоинты: Authorization: Bearer <ADMIN_HTTP_TOKEN> (без токена — выключены)
+def _is_admin(request):
+    if not ADMIN_HTTP_TOKEN:
+        return False
+    token = request.headers.get("Authorization", "").removeprefix("Bearer ").strip()
+    return hmac.compare_digest(token, ADMIN_HTTP_TOKEN)
+
+async def admin_stats(request):
+    if not _is_admin(request):
+        raise web.HTTPForbidden()
+    total, active, keys_issued, total_balance = await adb.get_user_totals()
+    return web.json_response({
+        "users": total,
+        "active": active,
+        "keys_issued": keys_issued,
+        "total_balance": total_balance,
+        "counters": await adb.get_stats_totals(),
+    })
+
+async def admin_pool(request):
+    if not _is_admin(request):
+        raise web.HTTPForbidden()
+    size, oldest, newest = await adb.get_pool_stats()
+    return web.json_response({"size": size, "oldest": oldest, "newest": newest})
+
+def create_app():
+    app = web.Application()
+    app.router.add_get("/", home)
+    app.router.add_get("/metrics", metrics_handler)
+    app.router.add_get("/admin/stats", admin_stats)
+    app.router.add_get("/admin/pool", admin_pool)
+    return app
+
+# 🚀 Запускает сервер в текущем цикле событий (вместо Flask в отдельном потоке)
+async def keep_alive(app=None):
+    runner = web.AppRunner(app or create_app())
+    await runner.setup()
+    await web.TCPSite(runner, HOST, PORT).start()
+    return runner
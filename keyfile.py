@@ -0,0 +1,119 @@
+import asyncio
+import logging
+import os
+import time
+
+import aiofiles
+from aiogram.exceptions import TelegramBadRequest
+
+import adb
+from parser import extract_links
+from validator import CONCURRENCY, validate_many
+
+# 📥 Импорт и выгрузка ключей файлом (для админа)
+READ_CHUNK = 1 << 20      # читаем файл по мегабайту
+IMPORT_BATCH = 2000       # ссылок на одну проверку
+IMPORT_PARALLEL = 4       # пачек проверяется одновременно
+INSERT_CHUNK = 1000       # ключей на одну транзакцию
+PROGRESS_INTERVAL = 3     # как часто обновлять сообщение с прогрессом, сек
+EXPORT_CHUNK = 5000
+
+class ImportProgress:
+    __slots__ = ("links", "duplicates", "known", "checked", "alive", "added", "started")
+
+    def __init__(self):
+        self.links = self.duplicates = self.known = self.checked = self.alive = self.added = 0
+        self.started = time.monotonic()
+
+    def text(self, title="📥 Импорт ключей…"):
+        return (
+            f"<b>{title}</b>\n"
+            f"🔗 Ссылок в файле: {self.links} (повторов: {self.duplicates})\n"
+            f"🗃 Уже в базе: {self.known}\n"
+            f"🧪 Проверено: {self.checked}, живых: {self.alive}\n"
+            f"➕ Добавлено в пул: {self.added}\n"
+            f"⏱ {time.monotonic() - self.started:.0f} с"
+        )
+
+# Файл читается кусками, ссылки отдаются пачками по IMPORT_BATCH без повторов
+async def _read_batches(path, progress):
+    seen = set()
+    batch = []
+    tail = ""
+    async with aiofiles.open(path, encoding="utf-8", errors="ignore") as f:
+        while True:
+            chunk = await f.read(READ_CHUNK)
+            text, _, tail = (tail + chunk).rpartition("\n") if chunk else (tail, "", "")
+            for link in extract_links(text):
+                progress.links += 1
+                if link in seen:
+                    progress.duplicates += 1
+                    continue
+                seen.add(link)
+                batch.append(link)
+                if len(batch) >= IMPORT_BATCH:
+                    yield batch
+                    batch = []
+            if not chunk:
+                break
+    if batch:
+        yield batch
+
+# 🧪 Пачки проверяются параллельно (не больше IMPORT_PARALLEL), пока читается следующая;
+# известные ключи отсеиваются по индексу до проверки, живые пишутся executemany кусками
+async def import_keys(path, progress):
+    slots = asyncio.Semaphore(IMPORT_PARALLEL)
+
+    async def process(links):
+        try:
+            known = await adb.existing_keys(links)
+            fresh = [link for link in links if link not in known]
+            progress.known += len(known)
+            alive = await validate_many(fresh, concurrency=CONCURRENCY // IMPORT_PARALLEL, deadline=None)
+            progress.checked += len(fresh)
+            progress.alive += len(alive)
+            for i in range(0, len(alive), INSERT_CHUNK):
+                added = await adb.add_keys(alive[i:i + INSERT_CHUNK], True)
+                progress.added += added
+        finally:
+            slots.release()
+
+    tasks = []
+    async for links in _read_batches(path, progress):
+        await slots.acquire()
+        tasks.append(asyncio.create_task(process(links)))
+    await asyncio.gather(*tasks)
+
+# Фоновый импорт с прогрессом в сообщении status; файл удаляется по окончании
+async def run_import(path, status):
+    progress = ImportProgress()
+    task = asyncio.create_task(import_keys(path, progress))
+    try:
+        while not task.done():
+            await asyncio.wait({task}, timeout=PROGRESS_INTERVAL)
+            if not task.done():
+                try:
+                    await status.edit_text(progress.text())
+                except TelegramBadRequest:
+                    pass
+        task.result()
+        await status.edit_text(progress.text("✅ Импорт завершён"))
+    except Exception:
+        logging.exception("[keyfile] Ошибка импорта ключей")
+        await status.edit_text(progress.text("❌ Импорт прерван ошибкой"))
+    finally:
+        os.remove(path)
+
+# 📤 Свободные ключи пула в файл, по одному на строку. Возвращает количество
+async def export_keys(path):
+    count = 0
+    after_id = 0
+    async with aiofiles.open(path, "w", encoding="utf-8") as f:
+        while True:
+            rows = await adb.export_keys(after_id, EXPORT_CHUNK)
+            if not rows:
+                break
+            await f.write("".join(f"{key}\n" for _, key, _, _ in rows))
+            count += len(rows)
+            after_id = rows[-1][0]
+    return count
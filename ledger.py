@@ -0,0 +1,97 @@
+import asyncio
+import csv
+import io
+import logging
+from datetime import datetime, timedelta
+
+import aiofiles
+from aiogram.utils.keyboard import InlineKeyboardBuilder
+
+import adb
+
+# 📒 Журнал операций: история страницами, выгрузка в CSV, сжатие старых строк и сверка балансов
+PAGE_SIZE = 10
+KEEP_DAYS = 90            # операции старше этого сжимаются в помесячные итоги
+COMPACT_CHUNK = 5000      # строк за одну транзакцию сжатия
+COMPACT_INTERVAL = 86400  # как часто сжимать, сек
+EXPORT_CHUNK = 5000
+
+def op_line(op):
+    _, op_type, amount, comment, date = op
+    sign = "+" if int(amount) > 0 else ""
+    return f"{date} — {op_type}: {sign}{amount}₽ ({comment})"
+
+def month_line(row):
+    month, op_type, amount, count = row
+    sign = "+" if amount > 0 else ""
+    return f"{month} — {op_type}: {sign}{amount}₽ ({count} оп.)"
+
+# callback_data: hist:<older|newer>:<id операции>
+async def render_history(user_id, direction="older", cursor=None):
+    if direction == "newer":
+        ops, more_newer = await adb.get_operations_page(user_id, after_id=cursor, limit=PAGE_SIZE)
+        more_older = True
+    else:
+        ops, more_older = await adb.get_operations_page(user_id, before_id=cursor, limit=PAGE_SIZE)
+        more_newer = cursor is not None
+
+    text = "<b>📊 История операций:</b>\n" + "\n".join(op_line(op) for op in ops)
+    if not more_older:
+        archive = await adb.get_operations_monthly(user_id)
+        if archive:
+            text += "\n\n<b>🗄 Ранее, по месяцам:</b>\n" + "\n".join(month_line(row) for row in archive)
+        elif not ops:
+            text = "ℹ️ Нет операций."
+
+    kb = InlineKeyboardBuilder()
+    if ops and more_newer:
+        kb.button(text="⬅️ Новее", callback_data=f"hist:newer:{ops[0][0]}")
+    if ops and more_older:
+        kb.button(text="Старше ➡️", callback_data=f"hist:older:{ops[-1][0]}")
+    return text, kb.as_markup()
+
+# 📤 Выгрузка операций в CSV пачками — в памяти не больше EXPORT_CHUNK строк
+async def export_csv(path, user_id=None):
+    count = 0
+    after_id = 0
+    async with aiofiles.open(path, "w", encoding="utf-8", newline="") as f:
+        await f.write("id,user_id,type,amount,comment,date\n")
+        while True:
+            rows = await adb.export_operations(after_id, EXPORT_CHUNK, user_id)
+            if not rows:
+                break
+            buf = io.StringIO()
+            csv.writer(buf).writerows(rows)
+            await f.write(buf.getvalue())
+            count += len(rows)
+            after_id = rows[-1][0]
+    return count
+
+# 🗜 Сжимает всё старше keep_days пачками по COMPACT_CHUNK (каждая — своя транзакция)
+async def compact(keep_days=KEEP_DAYS):
+    cutoff = (datetime.now() - timedelta(days=keep_days)).strftime("%Y-%m-%d")
+    total = 0
+    while True:
+        count = await adb.compact_operations(cutoff, COMPACT_CHUNK)
+        total += count
+        if count < COMPACT_CHUNK:
+            break
+    if total:
+        logging.info(f"[ledger] Сжато операций старше {cutoff}: {total}")
+    return total
+
+async def compact_loop():
+    while True:
+        try:
+            await compact()
+        except Exception:
+            logging.exception("[ledger] Ошибка сжатия журнала")
+        await asyncio.sleep(COMPACT_INTERVAL)
+
+# ⚖️ Для админа: расхождения users.balance с журналом
+async def reconcile_report():
+    count, rows = await adb.reconcile_balances()
+    if not count:
+        return "⚖️ Балансы сходятся с журналом."
+    lines = "\n".join(f"id {user_id}: баланс {balance}₽, по журналу {expected}₽" for user_id, balance, expected in rows)
+    return f"<b>⚖️ Расхождений: {count}</b>\n{lines}"
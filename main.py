@@ -1,32 +1,53 @@
 import asyncio
+import html
 import logging
 import os
+import tempfile
 from aiogram import Bot, Dispatcher, types, F
 from aiogram.types import (
-    Message, InlineKeyboardMarkup, InlineKeyboardButton,
+    Message, FSInputFile, InlineKeyboardMarkup, InlineKeyboardButton,
     ReplyKeyboardMarkup, KeyboardButton,
     BotCommand, BotCommandScopeDefault, MenuButtonCommands
 )
 from aiogram.enums import ParseMode
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.client.default import DefaultBotProperties
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
 from dotenv import load_dotenv
 from datetime import datetime, timedelta
 
-import db
-from parser import get_v2_keys, validate_v2_key
-from keep_alive import keep_alive
-from db import delete_inactive_keys
+import adb
+import browser
+import expiry
+import keyfile
+import ledger
+import maintenance
+import metrics
+import monitor
+import outbox
+import pool
+import stats
+import throttle
+import workers
+from keep_alive import create_app, keep_alive
 
 # Загружаем .env
 load_dotenv()
 TOKEN = os.getenv("BOT_TOKEN")
 ADMIN_USERNAME = os.getenv("ADMIN_USERNAME")
 ADMIN_ID = int(os.getenv("ADMIN_ID", "0"))  # обязательно укажи свой Telegram ID в .env
+RUN_MODE = os.getenv("RUN_MODE", "polling")  # polling или webhook
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")  # публичный https-адрес сервера
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
 
 bot = Bot(token=TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
 dp = Dispatcher(storage=MemoryStorage())
+dp.message.middleware(metrics.HandlerTimingMiddleware())
+dp.callback_query.middleware(throttle.ThrottleMiddleware())
+dp.callback_query.middleware(metrics.HandlerTimingMiddleware())
 
 # Меню
 main_reply_menu = ReplyKeyboardMarkup(
@@ -52,28 +73,21 @@ def user_keyboard(is_admin=False):
 def admin_keyboard():
     kb = InlineKeyboardBuilder()
     kb.button(text="👤 Все пользователи", callback_data="all_users")
+    kb.button(text="🔋 Пул ключей", callback_data="pool_info")
     kb.button(text="⬅️ Назад", callback_data="back")
     return kb.as_markup()
 
 def extend_subscription(days: int):
     return (datetime.today() + timedelta(days=days)).strftime("%Y-%m-%d")
 
-def check_subscription_expiry(user_id):
-    user = db.get_user(user_id)
-    if not user:
-        return False
-    until = user[5]
-    if not until:
-        return False
-    today = datetime.today().date()
-    try:
-        exp = datetime.strptime(until, "%Y-%m-%d").date()
-        if today > exp:
-            db.set_inactive(user_id)
-            return False
-        return True
-    except:
-        return False
+# 👤 Текст профиля из одной записи пользователя
+def profile_text(user):
+    balance = user.balance if user else 0
+    until = user.until if user else "-"
+    text = f"👤 <b>Профиль:</b>\n💸 Баланс: {balance}₽\n📅 Подписка до: {until}"
+    if user and user.user_key:
+        text += f"\n🔑 Ключ: <code>{html.escape(user.user_key)}</code>"
+    return text
 
 @dp.message(F.text == "/start")
 async def start(message: Message):
@@ -82,65 +96,52 @@ async def start(message: Message):
     args = message.text.split()
     ref_id = int(args[1]) if len(args) > 1 and args[1].isdigit() else None
 
-    is_new = db.add_user(user_id, username, referral_from=ref_id)
-    check_subscription_expiry(user_id)
+    is_new = await adb.add_user(user_id, username, referral_from=ref_id)
     await message.answer("👋 Привет! Добро пожаловать в бота.", reply_markup=main_reply_menu)
 
     if is_new and username != ADMIN_USERNAME:
-        try:
-            msg = f"👤 Новый пользователь: @{username} (ID: {user_id})"
-            if ref_id:
-                msg += f"\n👥 Пригласивший: {ref_id}"
-            await bot.send_message(ADMIN_ID, msg)
-        except:
-            pass
+        msg = f"👤 Новый пользователь: @{username} (ID: {user_id})"
+        if ref_id:
+            msg += f"\n👥 Пригласивший: {ref_id}"
+        outbox.notify_admin("signup", msg)
 
 @dp.message(F.text == "/profile")
 async def profile(message: Message):
-    user = db.get_user(message.from_user.id)
-    balance = db.get_balance(message.from_user.id)
-    until = user[5] if user else "-"
-    key = db.get_user_key(message.from_user.id)
-    text = f"👤 <b>Профиль:</b>\n💸 Баланс: {balance}₽\n📅 Подписка до: {until}"
-    if key:
-        text += f"\n🔑 Ключ: <code>{key}</code>"
-    await message.answer(text)
+    await message.answer(profile_text(await adb.get_user(message.from_user.id)))
 
 @dp.callback_query(F.data == "install_v2")
 async def install_v2(call: types.CallbackQuery):
     user_id = call.from_user.id
-    user = db.get_user(user_id)
-    check_subscription_expiry(user_id)
-
-    if not db.is_user_active(user_id):
-        if not user[4]:
-            keys = get_v2_keys()
-            for k in keys:
-                if validate_v2_key(k):
-                    db.add_key(k)
-                    db.update_until(user_id, extend_subscription(3))
-                    db.set_trial_used(user_id)
-                    db.assign_key_to_user(user_id, k)
-                    await call.message.answer(f"🧪 Пробный ключ (3 дня):\n<code>{k}</code>")
-                    return
-            await call.message.answer("❌ Нет ключей.")
+    user = await adb.get_user(user_id)
+
+    if not user.is_active:
+        if not user.trial_used:
+            k = await pool.claim_key()
+            if not k:
+                await call.message.answer("⏳ Свободных ключей нет, подбираю свежий…")
+                k = await pool.claim_key(wait=True)
+            if not k:
+                await call.message.answer("❌ Нет ключей, попробуй позже.")
+            elif await adb.activate_trial(user_id, extend_subscription(3), k):
+                await call.message.answer(f"🧪 Пробный ключ (3 дня):\n<code>{html.escape(k)}</code>")
+            else:
+                await call.message.answer("⚠️ Пробник уже использован. Оформи подписку.")
         else:
             await call.message.answer("⚠️ Пробник уже использован. Оформи подписку.")
     else:
-        key = db.get_user_key(user_id)
-        await call.message.answer(f"🔑 Твой ключ:\n<code>{key}</code>")
+        await call.message.answer(f"🔑 Твой ключ:\n<code>{html.escape(str(user.user_key))}</code>")
 
 @dp.callback_query(F.data == "update_key")
 async def update_key(call: types.CallbackQuery):
-    key = db.get_user_key(call.from_user.id)
+    key = await monitor.current_key(call.from_user.id)
     if key:
-        await call.message.answer(f"🔁 Твой ключ:\n<code>{key}</code>")
+        await call.message.answer(f"🔁 Твой ключ:\n<code>{html.escape(key)}</code>")
     else:
         await call.message.answer("❌ У тебя нет ключа.")
 
 @dp.callback_query(F.data == "balance")
 async def balance_menu(call: types.CallbackQuery):
-    balance = db.get_balance(call.from_user.id)
+    balance = await adb.get_balance(call.from_user.id)
     kb = InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="💸 Оплатить подписку (1 мес)", callback_data="pay_with_balance")],
         [InlineKeyboardButton(text="💳 Пополнить баланс", callback_data="topup_info")]
@@ -155,12 +156,9 @@ async def topup_info(call: types.CallbackQuery):
 async def pay_with_balance(call: types.CallbackQuery):
     user_id = call.from_user.id
     price = 300
-    balance = db.get_balance(user_id)
-    if balance >= price:
-        db.update_balance(user_id, -price, "Покупка подписки")
-        db.update_until(user_id, extend_subscription(30))
+    if await adb.purchase_subscription(user_id, price, extend_subscription(30), "Покупка подписки", 30) is not None:
         await call.message.answer("✅ Подписка активирована на 30 дней!")
-        await bot.send_message(ADMIN_ID, f"💸 Подписка (1 мес) от @{call.from_user.username} (ID: {user_id}) — 300₽")
+        outbox.notify_admin("payment", f"💸 Подписка (1 мес) от @{call.from_user.username} (ID: {user_id}) — 300₽", price)
     else:
         await call.message.answer("❌ Недостаточно средств.")
 
@@ -182,14 +180,11 @@ async def handle_subscription(call: types.CallbackQuery):
         "sub_12m": (2500, 365)
     }
     price, days = price_map[call.data]
-    balance = db.get_balance(user_id)
-    if balance < price:
+    if await adb.purchase_subscription(user_id, price, extend_subscription(days), f"Подписка на {days} дней", days) is None:
         await call.message.answer("❌ Недостаточно средств.")
         return
-    db.update_balance(user_id, -price, f"Подписка на {days} дней")
-    db.update_until(user_id, extend_subscription(days))
     await call.message.answer(f"✅ Подписка до {extend_subscription(days)}!\nСписано {price}₽.")
-    await bot.send_message(ADMIN_ID, f"💸 Подписка на {days} дней от @{call.from_user.username} (ID: {user_id}) — {price}₽")
+    outbox.notify_admin("payment", f"💸 Подписка на {days} дней от @{call.from_user.username} (ID: {user_id}) — {price}₽", price)
 
 @dp.callback_query(F.data == "referrals")
 async def referrals(call: types.CallbackQuery):
@@ -203,9 +198,30 @@ async def admin_menu(call: types.CallbackQuery):
 
 @dp.callback_query(F.data == "all_users")
 async def all_users(call: types.CallbackQuery):
-    users = db.get_all_users()
-    msg = "\n".join([f"👤 {u[1]} | id: {u[0]} | до: {u[5] or '-'}" for u in users])
-    await call.message.answer(f"<b>Все пользователи:</b>\n{msg or 'Нет пользователей.'}")
+    if call.from_user.username != ADMIN_USERNAME:
+        return await call.answer()
+    text, kb = await browser.render_page()
+    await call.message.answer(text, reply_markup=kb)
+    await call.answer()
+
+@dp.callback_query(F.data.startswith("users:"))
+async def users_page(call: types.CallbackQuery):
+    if call.from_user.username != ADMIN_USERNAME:
+        return await call.answer()
+    _, raw_filter, direction, cursor = call.data.split(":")
+    text, kb = await browser.render_page(raw_filter, direction, int(cursor))
+    try:
+        await call.message.edit_text(text, reply_markup=kb)
+    except TelegramBadRequest:
+        pass  # тот же фильтр и страница: "message is not modified"
+    await call.answer()
+
+@dp.callback_query(F.data == "pool_info")
+async def pool_info_cb(call: types.CallbackQuery):
+    if call.from_user.username != ADMIN_USERNAME:
+        return await call.answer()
+    await call.message.answer(await pool.pool_info())
+    await call.answer()
 
 @dp.callback_query(F.data == "back")
 async def back(call: types.CallbackQuery):
@@ -219,14 +235,7 @@ async def reply_main_menu(message: Message):
 
 @dp.message(F.text == "👤 Личный кабинет")
 async def reply_profile_button(message: Message):
-    user = db.get_user(message.from_user.id)
-    balance = db.get_balance(message.from_user.id)
-    until = user[5] if user else "-"
-    key = db.get_user_key(message.from_user.id)
-    text = f"👤 <b>Профиль:</b>\n💸 Баланс: {balance}₽\n📅 Подписка до: {until}"
-    if key:
-        text += f"\n🔑 Ключ: <code>{key}</code>"
-    await message.answer(text)
+    await message.answer(profile_text(await adb.get_user(message.from_user.id)))
 
 @dp.message(F.text == "❓ Помощь в подключении")
 async def reply_help(message: Message):
@@ -240,15 +249,18 @@ async def reply_help(message: Message):
 
 @dp.message(F.text == "/history")
 async def user_history(message: Message):
-    ops = db.get_user_operations(message.from_user.id)
-    if not ops:
-        await message.answer("ℹ️ Нет операций.")
-        return
-    text = "<b>📊 История операций:</b>\n"
-    for t, a, c, d in ops:
-        sign = "+" if int(a) > 0 else ""
-        text += f"{d} — {t}: {sign}{a}₽ ({c})\n"
-    await message.answer(text)
+    text, kb = await ledger.render_history(message.from_user.id)
+    await message.answer(text, reply_markup=kb)
+
+@dp.callback_query(F.data.startswith("hist:"))
+async def history_page(call: types.CallbackQuery):
+    _, direction, cursor = call.data.split(":")
+    text, kb = await ledger.render_history(call.from_user.id, direction, int(cursor))
+    try:
+        await call.message.edit_text(text, reply_markup=kb)
+    except TelegramBadRequest:
+        pass  # двойное нажатие: "message is not modified"
+    await call.answer()
 
 # Админ команды
 @dp.message(F.text.startswith("/admin_balance"))
@@ -257,52 +269,118 @@ async def admin_balance_cmd(message: Message):
         return
     try:
         _, uid, amount = message.text.strip().split()
-        db.update_balance(int(uid), int(amount), "Пополнение (админ)")
+        await adb.update_balance(int(uid), int(amount), "Пополнение (админ)")
         await message.answer(f"✅ {amount}₽ → {uid}")
     except Exception:
         await message.answer("⚠️ /admin_balance user_id сумма")
 
-@dp.message(F.text == "/admin_users")
+@dp.message(F.text.startswith("/admin_users"))
 async def admin_users_cmd(message: Message):
     if message.from_user.username != ADMIN_USERNAME:
         return
-    users = db.get_all_users()
-    text = "\n".join([
-        f"👤 {u[1]} | id: {u[0]} | ₿ {db.get_balance(u[0])}₽ | до: {u[5] or '-'}"
-        for u in users
-    ])
-    await message.answer(text or "Нет пользователей.")
+    # /admin_users или /admin_users ref 123 — рефералы пользователя 123
+    args = message.text.split()
+    raw_filter = f"ref={args[2]}" if len(args) > 2 and args[1] == "ref" else (args[1] if len(args) > 1 else "all")
+    text, kb = await browser.render_page(raw_filter)
+    await message.answer(text, reply_markup=kb)
+
+@dp.message(F.text.startswith("/find"))
+async def admin_find(message: Message):
+    if message.from_user.username != ADMIN_USERNAME:
+        return
+    args = message.text.split(maxsplit=1)
+    if len(args) < 2:
+        await message.answer("⚠️ /find username или id")
+        return
+    await message.answer(await browser.render_search(args[1].strip()))
 
 @dp.message(F.text == "/check_all")
 async def admin_check_all(message: Message):
     if message.from_user.username != ADMIN_USERNAME:
         return
-    count = 0
-    users = db.get_all_users()
-    for u in users:
-        uid = u[0]
-        if not check_subscription_expiry(uid):
-            count += 1
+    count = await expiry.expire_now()
     await message.answer(f"⛔ Отключено {count} пользователей по окончании подписки.")
 
 @dp.message(F.text == "/stats")
 async def admin_stats(message: Message):
     if message.from_user.username != ADMIN_USERNAME:
         return
-    users = db.get_all_users()
-    total = len(users)
-    active = sum(1 for u in users if u[6] == 1)
-    total_balance = sum(db.get_balance(u[0]) for u in users)
-    avg_balance = total_balance // total if total else 0
-    keys_issued = sum(1 for u in users if u[7])
-    await message.answer(
-        f"<b>📊 Статистика:</b>\n"
-        f"👥 Всего пользователей: {total}\n"
-        f"✅ Активных: {active}\n"
-        f"🔑 С ключами: {keys_issued}\n"
-        f"💰 Общий баланс: {total_balance}₽\n"
-        f"📈 Средний баланс: {avg_balance}₽"
-    )
+    await message.answer(await stats.build_report())
+
+@dp.message(F.text.startswith("/broadcast"))
+async def admin_broadcast(message: Message):
+    if message.from_user.username != ADMIN_USERNAME:
+        return
+    args = message.text.split(maxsplit=1)
+    if len(args) < 2:
+        await message.answer("⚠️ /broadcast текст")
+        return
+
+    asyncio.create_task(outbox.broadcast(args[1], report_to=message.chat.id))
+    await message.answer("📢 Рассылка запущена")
+
+@dp.message(F.text.startswith("/export_ops"))
+async def admin_export_ops(message: Message):
+    if message.from_user.username != ADMIN_USERNAME:
+        return
+    # /export_ops — все операции, /export_ops 123 — одного пользователя
+    args = message.text.split()
+    user_id = int(args[1]) if len(args) > 1 and args[1].isdigit() else None
+    fd, path = tempfile.mkstemp(suffix=".csv")
+    os.close(fd)
+    try:
+        count = await ledger.export_csv(path, user_id)
+        name = f"operations-{user_id or 'all'}-{datetime.now():%Y%m%d}.csv"
+        await message.answer_document(FSInputFile(path, filename=name), caption=f"📤 Операций: {count}")
+    finally:
+        os.remove(path)
+
+@dp.message(F.text == "/reconcile")
+async def admin_reconcile(message: Message):
+    if message.from_user.username != ADMIN_USERNAME:
+        return
+    await message.answer(await ledger.reconcile_report())
+
+@dp.message(F.text == "/import_keys")
+async def admin_import_help(message: Message):
+    if message.from_user.username != ADMIN_USERNAME:
+        return
+    await message.answer("📥 Пришли текстовый файл со ссылками vmess:// и vless:// — проверю и добавлю живые в пул.")
+
+@dp.message(F.document)
+async def admin_import_keys(message: Message):
+    if message.from_user.username != ADMIN_USERNAME:
+        return
+    fd, path = tempfile.mkstemp(suffix=".txt")
+    os.close(fd)
+    await bot.download(message.document, destination=path)
+    status = await message.answer("📥 Файл получен, начинаю импорт…")
+    asyncio.create_task(keyfile.run_import(path, status))
+
+@dp.message(F.text == "/export_keys")
+async def admin_export_keys(message: Message):
+    if message.from_user.username != ADMIN_USERNAME:
+        return
+    fd, path = tempfile.mkstemp(suffix=".txt")
+    os.close(fd)
+    try:
+        count = await keyfile.export_keys(path)
+        name = f"keys-{datetime.now():%Y%m%d-%H%M}.txt"
+        await message.answer_document(FSInputFile(path, filename=name), caption=f"🔑 Ключей в пуле: {count}")
+    finally:
+        os.remove(path)
+
+@dp.message(F.text == "/dbinfo")
+async def admin_dbinfo(message: Message):
+    if message.from_user.username != ADMIN_USERNAME:
+        return
+    await message.answer(await maintenance.report())
+
+@dp.message(F.text == "/pool")
+async def admin_pool(message: Message):
+    if message.from_user.username != ADMIN_USERNAME:
+        return
+    await message.answer(await pool.pool_info())
 
 # Команды Telegram-меню
 async def set_bot_commands():
@@ -313,23 +391,51 @@ async def set_bot_commands():
         BotCommand(command="check_all", description="⛔ Проверка подписок"),
         BotCommand(command="stats", description="📊 Статистика (админ)"),
         BotCommand(command="admin_users", description="📋 Пользователи (админ)"),
-        BotCommand(command="admin_balance", description="💰 Пополнение (админ)")
+        BotCommand(command="find", description="🔍 Поиск пользователя (админ)"),
+        BotCommand(command="admin_balance", description="💰 Пополнение (админ)"),
+        BotCommand(command="export_ops", description="📤 Выгрузка операций (админ)"),
+        BotCommand(command="reconcile", description="⚖️ Сверка балансов (админ)"),
+        BotCommand(command="pool", description="🔋 Пул ключей (админ)"),
+        BotCommand(command="dbinfo", description="🗄 Состояние базы (админ)"),
+        BotCommand(command="import_keys", description="📥 Импорт ключей файлом (админ)"),
+        BotCommand(command="export_keys", description="🔑 Выгрузка пула (админ)"),
+        BotCommand(command="broadcast", description="📢 Рассылка (админ)")
     ]
     await bot.set_my_commands(commands, scope=BotCommandScopeDefault())
     await bot.set_chat_menu_button(menu_button=MenuButtonCommands())
 
-# Очистка базы ключей
-async def periodic_cleanup():
-    while True:
-        delete_inactive_keys()
-        await asyncio.sleep(86400)  # раз в сутки
-
-# Запуск
+# Запуск: webhook при RUN_MODE=webhook (нужны WEBHOOK_URL и WEBHOOK_SECRET), иначе polling
 async def main():
-    keep_alive()
-    asyncio.create_task(periodic_cleanup())
+    if RUN_MODE == "webhook" and not (WEBHOOK_URL and WEBHOOK_SECRET):
+        # без секрета любой, кто знает адрес, может прислать поддельный апдейт
+        raise SystemExit("❌ RUN_MODE=webhook требует WEBHOOK_URL и WEBHOOK_SECRET в .env")
+    app = create_app()
+    if RUN_MODE == "webhook":
+        SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=WEBHOOK_SECRET).register(app, path=WEBHOOK_PATH)
+        setup_application(app, dp, bot=bot)
+    runner = await keep_alive(app)
+    # WORKERS > 1: этот процесс только принимает апдейты и крутит фоновые циклы
+    stop_workers = await workers.start(dp) if workers.WORKERS > 1 else None
+
+    outbox.start(bot, ADMIN_ID)
+    asyncio.create_task(maintenance.maintenance_loop())
+    asyncio.create_task(pool.harvester_loop())
+    asyncio.create_task(expiry.expiry_loop())
+    asyncio.create_task(ledger.compact_loop())
+    asyncio.create_task(monitor.monitor_loop())
     await set_bot_commands()
-    await dp.start_polling(bot)
+
+    try:
+        if RUN_MODE == "webhook":
+            await bot.set_webhook(WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH, secret_token=WEBHOOK_SECRET)
+            await asyncio.Event().wait()
+        else:
+            await bot.delete_webhook()
+            await dp.start_polling(bot)
+    finally:
+        if stop_workers:
+            stop_workers()
+        await runner.cleanup()
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO)
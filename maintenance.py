@@ -0,0 +1,163 @@
+import asyncio
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import adb
+import db
+import metrics
+
+# 🧰 Обслуживание базы: чистка кусками, checkpoint WAL, статистика запросов, бэкапы.
+# Тяжёлое (checkpoint, ANALYZE, бэкап) — в «тихие» периоды и на своём потоке со своим соединением.
+TICK = 60                        # сек между проверками расписания
+CLEANUP_INTERVAL = 3600
+CLEANUP_CHUNK = 1000             # строк за один DELETE
+CLEANUP_TIME_BOX = 2.0           # сек на одну чистку, остальное — в следующий раз
+CLEANUP_PAUSE = 0.05             # пауза между кусками, чтобы прошли записи пользователей
+HEALTH_KEEP = 7 * 86400          # записи о здоровье серверов старше этого удаляются
+CHECKPOINT_INTERVAL = 300
+OPTIMIZE_INTERVAL = 86400
+ANALYSIS_LIMIT = 1000            # строк на индекс при плановом ANALYZE
+BACKUP_INTERVAL = 86400
+BACKUP_DIR = os.getenv("DB_BACKUP_DIR", "backups")
+BACKUP_KEEP = 7                  # сколько последних копий хранить
+QUIET_HOURS = range(3, 7)        # местное время, когда нагрузка минимальна
+QUIET_RATE = 30                  # апдейтов в минуту, ниже которых период считается тихим
+
+_executor = ThreadPoolExecutor(1, thread_name_prefix="db-maintenance")
+_last_run = {}                   # задача -> time.monotonic() последнего запуска
+_started = time.monotonic()
+_updates_seen = None
+state = {
+    "info": None, "deleted_keys": 0, "deleted_health": 0,
+    "checkpoint": None, "optimized_at": None, "backup": None, "quiet": False,
+}
+
+@metrics.register_collector
+def _collect():
+    info = state["info"]
+    if info is None:
+        return []
+    return [
+        ("bot_db_file_bytes", {}, info["file_bytes"]),
+        ("bot_db_wal_bytes", {}, info["wal_bytes"]),
+        ("bot_db_pages", {}, info["pages"]),
+        ("bot_db_free_pages", {}, info["free_pages"]),
+        ("bot_db_cleanup_deleted_total", {}, state["deleted_keys"] + state["deleted_health"]),
+    ]
+
+async def _in_thread(func, *args):
+    return await asyncio.get_running_loop().run_in_executor(_executor, func, *args)
+
+# Тихо: ночные часы и мало апдейтов за последний тик (считаются и апдейты воркеров —
+# их метрики приходят в главный процесс; после перезапуска воркера разница бывает < 0)
+def _is_quiet():
+    global _updates_seen
+    seen = metrics.count("bot_handler_seconds")
+    rate = max(0, seen - _updates_seen) * 60 / TICK if _updates_seen is not None else 0
+    _updates_seen = seen
+    return datetime.now().hour in QUIET_HOURS and rate < QUIET_RATE
+
+# Пора ли запускать: прошёл interval. Тяжёлое — только в тихий период,
+# но не реже раза в 2×interval (отсчёт с запуска бота, если ещё не делалось)
+def _due(task, interval, quiet_only=False):
+    last = _last_run.get(task)
+    if not quiet_only:
+        return last is None or time.monotonic() - last >= interval
+    elapsed = time.monotonic() - (last if last is not None else _started)
+    if state["quiet"]:
+        return last is None or elapsed >= interval
+    return elapsed >= 2 * interval
+
+# 🧹 Удаление кусками по CLEANUP_CHUNK через поток записи, не дольше CLEANUP_TIME_BOX
+async def _chunked_delete(func, *args):
+    total = 0
+    deadline = time.monotonic() + CLEANUP_TIME_BOX
+    while time.monotonic() < deadline:
+        count = await func(*args, CLEANUP_CHUNK)
+        total += count
+        if count < CLEANUP_CHUNK:
+            break
+        await asyncio.sleep(CLEANUP_PAUSE)
+    return total
+
+async def cleanup():
+    keys = await _chunked_delete(adb.delete_inactive_keys)
+    health = await _chunked_delete(adb.delete_stale_endpoint_health, time.time() - HEALTH_KEEP)
+    state["deleted_keys"] += keys
+    state["deleted_health"] += health
+    if keys or health:
+        logging.info(f"[maintenance] Удалено выданных ключей: {keys}, старых записей здоровья: {health}")
+
+async def checkpoint():
+    mode = "TRUNCATE" if state["quiet"] else "PASSIVE"
+    state["checkpoint"] = (mode, *await _in_thread(db.checkpoint, mode))
+
+async def optimize():
+    started = time.monotonic()
+    await _in_thread(db.optimize, ANALYSIS_LIMIT)
+    state["optimized_at"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    logging.info(f"[maintenance] ANALYZE за {time.monotonic() - started:.1f} с")
+
+# 💾 Копия в BACKUP_DIR (сначала во временный файл), старше BACKUP_KEEP последних — удаляются
+async def backup():
+    os.makedirs(BACKUP_DIR, exist_ok=True)
+    name = f"{os.path.splitext(os.path.basename(db.DB_PATH))[0]}-{datetime.now():%Y%m%d-%H%M%S}.db"
+    path = os.path.join(BACKUP_DIR, name)
+    started = time.monotonic()
+    await _in_thread(db.backup_to, path + ".tmp")
+    os.replace(path + ".tmp", path)
+    state["backup"] = (name, os.path.getsize(path), round(time.monotonic() - started, 1))
+    backups = sorted(f for f in os.listdir(BACKUP_DIR) if f.endswith(".db"))
+    for old in backups[:-BACKUP_KEEP]:
+        os.remove(os.path.join(BACKUP_DIR, old))
+    logging.info(f"[maintenance] Бэкап {name} за {state['backup'][2]} с")
+
+TASKS = (
+    ("cleanup", CLEANUP_INTERVAL, False, cleanup),
+    ("checkpoint", CHECKPOINT_INTERVAL, False, checkpoint),
+    ("optimize", OPTIMIZE_INTERVAL, True, optimize),
+    ("backup", BACKUP_INTERVAL, True, backup),
+)
+
+async def maintenance_loop():
+    while True:
+        state["quiet"] = _is_quiet()
+        for name, interval, quiet_only, run in TASKS:
+            if _due(name, interval, quiet_only):
+                _last_run[name] = time.monotonic()
+                try:
+                    await run()
+                except Exception:
+                    logging.exception(f"[maintenance] Ошибка задачи {name}")
+        try:
+            state["info"] = await _in_thread(db.db_info)
+        except Exception:
+            logging.exception("[maintenance] Не удалось прочитать размер базы")
+        await asyncio.sleep(TICK)
+
+def _mb(size):
+    return f"{size / 1024 / 1024:.1f} МБ"
+
+# 📏 Для админа: размер, фрагментация и когда что делалось
+async def report():
+    info = state["info"] = await _in_thread(db.db_info)
+    fragmentation = info["free_pages"] * 100 / info["pages"] if info["pages"] else 0
+    lines = [
+        "<b>🗄 База данных:</b>",
+        f"📦 Файл: {_mb(info['file_bytes'])}, WAL: {_mb(info['wal_bytes'])}",
+        f"📄 Страниц: {info['pages']} по {info['page_size']} Б, свободных: {info['free_pages']} ({fragmentation:.1f}%)",
+        f"🧹 Удалено: ключей {state['deleted_keys']}, записей здоровья {state['deleted_health']}",
+    ]
+    if state["checkpoint"]:
+        mode, busy, wal_pages, moved = state["checkpoint"]
+        lines.append(f"🔁 Checkpoint ({mode}): перенесено {moved} из {wal_pages} страниц{', занято' if busy else ''}")
+    lines.append(f"📊 ANALYZE: {state['optimized_at'] or 'ещё не было'}")
+    if state["backup"]:
+        name, size, seconds = state["backup"]
+        lines.append(f"💾 Бэкап: {name} ({_mb(size)}, {seconds} с)")
+    else:
+        lines.append("💾 Бэкап: ещё не было")
+    return "\n".join(lines)
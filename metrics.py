@@ -0,0 +1,167 @@
+import inspect
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+
+from aiogram import BaseMiddleware
+
+# 📈 Метрики в памяти процесса, отдаются в формате Prometheus на /metrics
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+_lock = threading.Lock()
+_histograms = {}     # (name, labels) -> [counts по корзинам..., +Inf, сумма]
+_counters = {}       # (name, labels) -> value
+_collectors = []     # функции, возвращающие [(name, labels, value)] для gauge-метрик
+_help = {}
+_remote = {}         # воркер -> (histograms, counters, rows) из его последнего снимка
+
+def describe(name, text):
+    _help[name] = text
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+def observe(name, seconds, **labels):
+    key = _key(name, labels)
+    with _lock:
+        h = _histograms.get(key)
+        if h is None:
+            h = _histograms[key] = [0] * (len(BUCKETS) + 2)
+        h[bisect_left(BUCKETS, seconds)] += 1
+        h[-1] += seconds
+
+# Сколько наблюдений name всего — вместе с последними снимками воркеров
+def count(name):
+    with _lock:
+        histograms = [_histograms] + [snap[0] for snap in _remote.values()]
+        return sum(sum(h[:-1]) for hs in histograms for (n, _), h in hs.items() if n == name)
+
+def inc(name, value=1, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+# ⏱ Замер блока: with timed("bot_db_seconds", func="get_user"): ...
+@contextmanager
+def timed(name, **labels):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - started, **labels)
+
+# То же для функции (обычной или async)
+def timed_func(name, **labels):
+    def decorator(func):
+        labels.setdefault("func", func.__name__)
+        if inspect.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with timed(name, **labels):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with timed(name, **labels):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def register_collector(func):
+    _collectors.append(func)
+    return func
+
+# 📦 Всё накопленное в этом процессе — воркер пересылает это главному процессу
+def snapshot():
+    with _lock:
+        histograms = {k: list(v) for k, v in _histograms.items()}
+        counters = dict(_counters)
+    return histograms, counters, [row for collect in _collectors for row in collect()]
+
+# Запоминает последний снимок воркера source (заменяя прежний); с локальными данными его сводят render() и count()
+def merge_remote(source, snap):
+    with _lock:
+        _remote[source] = snap
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _fmt_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels) + "}"
+
+# 📝 Текст в формате Prometheus
+def render():
+    lines = []
+    with _lock:
+        merged = {k: list(v) for k, v in _histograms.items()}
+        counters = dict(_counters)
+        remote = list(_remote.items())
+    for _, (remote_histograms, remote_counters, _) in remote:
+        for key, values in remote_histograms.items():
+            h = merged.setdefault(key, [0] * len(values))
+            for i, value in enumerate(values):
+                h[i] += value
+        for key, value in remote_counters.items():
+            counters[key] = counters.get(key, 0) + value
+    histograms = sorted(merged.items())
+    counters = sorted(counters.items())
+
+    seen = set()
+    for (name, labels), h in histograms:
+        if name not in seen:
+            seen.add(name)
+            if name in _help:
+                lines.append(f"# HELP {name} {_help[name]}")
+            lines.append(f"# TYPE {name} histogram")
+        total = 0
+        for bound, count in zip(BUCKETS, h):
+            total += count
+            lines.append(f"{name}_bucket{_fmt_labels(labels + (('le', bound),))} {total}")
+        total += h[len(BUCKETS)]
+        lines.append(f"{name}_bucket{_fmt_labels(labels + (('le', '+Inf'),))} {total}")
+        lines.append(f"{name}_sum{_fmt_labels(labels)} {h[-1]}")
+        lines.append(f"{name}_count{_fmt_labels(labels)} {total}")
+
+    for (name, labels), value in counters:
+        if name not in seen:
+            seen.add(name)
+            if name in _help:
+                lines.append(f"# HELP {name} {_help[name]}")
+            lines.append(f"# TYPE {name} counter")
+        lines.append(f"{name}{_fmt_labels(labels)} {value}")
+
+    rows = [row for collect in _collectors for row in collect()]
+    for source, (_, _, remote_rows) in remote:
+        rows.extend((name, {**labels, "worker": source}, value) for name, labels, value in remote_rows)
+    rows.sort(key=lambda row: row[0])    # строки одной метрики должны идти подряд
+    for name, labels, value in rows:
+        if name not in seen:
+            seen.add(name)
+            lines.append(f"# TYPE {name} {'counter' if name.endswith('_total') else 'gauge'}")
+        lines.append(f"{name}{_fmt_labels(tuple(sorted(labels.items())))} {value}")
+    return "\n".join(lines) + "\n"
+
+# 🧭 Middleware aiogram: время каждого хендлера и ошибки
+class HandlerTimingMiddleware(BaseMiddleware):
+    async def __call__(self, handler, event, data):
+        handler_obj = data.get("handler")
+        name = getattr(getattr(handler_obj, "callback", None), "__name__", "unknown")
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            inc("bot_handler_errors_total", handler=name)
+            raise
+        finally:
+            observe("bot_handler_seconds", time.perf_counter() - started, handler=name)
+
+describe("bot_handler_seconds", "Время обработки апдейта хендлером")
+describe("bot_db_seconds", "Время вызова функции БД, включая ожидание в очереди")
+describe("bot_fetch_seconds", "Время загрузки источника ключей")
+describe("bot_probe_seconds", "Время TCP-проверки сервера")
+describe("bot_validate_seconds", "Время проверки пачки ключей")
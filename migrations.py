@@ -0,0 +1,176 @@
+from datetime import datetime
+
+# 🧬 Версионные миграции схемы. Новые добавлять только в конец списка MIGRATIONS.
+
+# 🧩 Добавляет колонку в уже существующую таблицу
+def _ensure_column(cursor, table, column, ddl):
+    cursor.execute(f"PRAGMA table_info({table})")
+    if column not in [row[1] for row in cursor.fetchall()]:
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}")
+
+# 1️⃣ Исходные таблицы
+def _base_tables(cursor):
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS users (
+        user_id INTEGER PRIMARY KEY,
+        username TEXT,
+        balance INTEGER DEFAULT 0,
+        referral_from INTEGER,
+        trial_used BOOLEAN DEFAULT 0,
+        until TEXT,
+        is_active BOOLEAN DEFAULT 0,
+        user_key TEXT
+    )
+    ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS keys (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        key TEXT,
+        active BOOLEAN DEFAULT 1
+    )
+    ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS operations (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        type TEXT,
+        amount INTEGER,
+        comment TEXT,
+        date TEXT
+    )
+    ''')
+
+# 2️⃣ Пул ключей: время добавления и задержка
+def _key_pool_columns(cursor):
+    _ensure_column(cursor, "keys", "added_at", "TEXT")
+    _ensure_column(cursor, "keys", "latency", "REAL")
+
+# 3️⃣ Индексы под горячие запросы и уникальность ключей
+def _hot_indexes(cursor):
+    cursor.execute("DELETE FROM keys WHERE id NOT IN (SELECT MIN(id) FROM keys GROUP BY key)")
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_keys_key ON keys(key)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_keys_active ON keys(active)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_operations_user ON operations(user_id, id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_users_referral ON users(referral_from)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_users_until ON users(until)")
+
+# 4️⃣ Дневные счётчики для статистики + дата регистрации.
+# Покупки получают тип «подписка»; старые покупки переносим в счётчики по их дате.
+def _daily_stats(cursor):
+    _ensure_column(cursor, "users", "created_at", "TEXT")
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS stats_daily (
+        day TEXT,
+        metric TEXT,
+        value INTEGER DEFAULT 0,
+        PRIMARY KEY (day, metric)
+    ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        UPDATE operations SET type='подписка'
+        WHERE amount < 0 AND (comment='Покупка подписки' OR comment LIKE 'Подписка на % дней')
+    ''')
+    cursor.execute('''
+        INSERT INTO stats_daily (day, metric, value)
+        SELECT substr(date, 1, 10), 'payments', COUNT(*) FROM operations WHERE type='подписка' GROUP BY 1
+        UNION ALL
+        SELECT substr(date, 1, 10), 'revenue', -SUM(amount) FROM operations WHERE type='подписка' GROUP BY 1
+        UNION ALL
+        SELECT substr(date, 1, 10),
+               'revenue:' || CASE WHEN comment='Покупка подписки' THEN 30 ELSE CAST(substr(comment, 13) AS INTEGER) END,
+               -SUM(amount)
+        FROM operations WHERE type='подписка' GROUP BY 1, 2
+    ''')
+
+# 5️⃣ Индексы для постраничного просмотра и поиска пользователей
+def _user_browser_indexes(cursor):
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_users_username ON users(username COLLATE NOCASE)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_users_active ON users(is_active)")
+
+# 6️⃣ Планировщик окончания подписок: индекс по активным и дате, отметка о напоминании
+def _expiry_scheduler(cursor):
+    _ensure_column(cursor, "users", "reminded_until", "TEXT")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_users_active_until ON users(is_active, until)")
+
+# 7️⃣ Здоровье серверов: последний результат проверки по host:port
+def _endpoint_health(cursor):
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS endpoint_health (
+        endpoint TEXT PRIMARY KEY,
+        ok BOOLEAN,
+        latency REAL,
+        checked_at REAL,
+        failures INTEGER DEFAULT 0,
+        next_probe_at REAL
+    ) WITHOUT ROWID
+    ''')
+
+# 8️⃣ Журнал операций: помесячные итоги вместо старых строк и снимки балансов
+def _ledger(cursor):
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS operations_monthly (
+        user_id INTEGER,
+        month TEXT,
+        type TEXT,
+        amount INTEGER DEFAULT 0,
+        count INTEGER DEFAULT 0,
+        PRIMARY KEY (user_id, month, type)
+    ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS balance_snapshots (
+        user_id INTEGER PRIMARY KEY,
+        balance INTEGER DEFAULT 0,
+        through_id INTEGER,
+        taken_at TEXT
+    ) WITHOUT ROWID
+    ''')
+
+# 9️⃣ Мониторинг выданных ключей: когда ключ пользователя проверяли последний раз
+def _key_monitor(cursor):
+    _ensure_column(cursor, "users", "key_checked_at", "REAL")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_users_active_key_checked ON users(is_active, key_checked_at)")
+
+# 🔟 Импортированные админом ключи не протухают по KEY_TTL
+def _imported_keys(cursor):
+    _ensure_column(cursor, "keys", "imported", "BOOLEAN DEFAULT 0")
+
+MIGRATIONS = [
+    (1, "base tables", _base_tables),
+    (2, "key pool columns", _key_pool_columns),
+    (3, "hot query indexes", _hot_indexes),
+    (4, "daily stats counters", _daily_stats),
+    (5, "user browser indexes", _user_browser_indexes),
+    (6, "expiry scheduler", _expiry_scheduler),
+    (7, "endpoint health", _endpoint_health),
+    (8, "ledger compaction", _ledger),
+    (9, "key monitor", _key_monitor),
+    (10, "imported keys", _imported_keys),
+]
+
+def current_version(conn):
+    return conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()[0]
+
+# 🚀 Применяет недостающие миграции, каждую в своей транзакции
+def migrate(conn):
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        name TEXT,
+        applied_at TEXT
+    )
+    ''')
+    for version, name, apply in MIGRATIONS:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if current_version(conn) < version:
+                apply(conn.cursor())
+                conn.execute(
+                    "INSERT INTO schema_version (version, name, applied_at) VALUES (?, ?, ?)",
+                    (version, name, datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+                )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+    return current_version(conn)
@@ -0,0 +1,93 @@
+import asyncio
+import html
+import logging
+import time
+
+import adb
+import metrics
+import outbox
+import pool
+from parser import parse_link
+from validator import endpoint_key, validate_many
+
+# 🩺 Фоновая перепроверка выданных ключей: мёртвый ключ меняется на свежий из пула
+CHECK_EVERY = 3600          # ключ перепроверяется не чаще, сек
+DEAD_RETRY = 300            # мёртвый ключ без замены (пул пуст) — повтор через столько, сек
+PROBES_PER_MINUTE = 600     # бюджет: ключей на проверку в минуту
+CONCURRENCY = 32            # одновременных TCP-проверок
+TICK = 10                   # сек между порциями
+
+stats = {"checked": 0, "dead": 0, "rotated": 0, "pool_empty": 0}
+
+@metrics.register_collector
+def _collect():
+    return [(f"bot_key_monitor_{name}_total", {}, value) for name, value in stats.items()]
+
+def _notify(rotated):
+    for user_id, key in rotated:
+        outbox.send(user_id, f"♻️ Твой ключ перестал отвечать, вот новый:\n<code>{html.escape(key)}</code>")
+    outbox.notify_admin("rotation", f"♻️ Заменено мёртвых ключей: {len(rotated)}", len(rotated))
+
+# 🔍 Одна порция: limit давно не проверенных ключей активных пользователей.
+# Свежие результаты берутся из кэша здоровья, остальное проверяется с ограничением CONCURRENCY
+async def check_batch(limit):
+    now = time.time()
+    rows = await adb.get_due_key_checks(now - CHECK_EVERY, limit)
+    if not rows:
+        return 0
+    checkable = [key for _, key in rows if parse_link(key)]
+    alive = {link for link, _ in await validate_many(checkable, concurrency=CONCURRENCY, deadline=None)}
+    checkable = set(checkable)
+
+    rotated = []
+    retry = []
+    for user_id, key in rows:
+        if key not in checkable or key in alive:
+            continue
+        stats["dead"] += 1
+        new_key = await adb.rotate_key(user_id, key, pool.fresh_after())
+        if new_key:
+            rotated.append((user_id, new_key))
+        else:
+            retry.append(user_id)
+
+    retry_set = set(retry)
+    await adb.mark_keys_checked([user_id for user_id, _ in rows if user_id not in retry_set], now)
+    if retry:
+        stats["pool_empty"] += len(retry)
+        await adb.mark_keys_checked(retry, now - CHECK_EVERY + DEAD_RETRY)
+    if rotated or retry:
+        pool.wake()
+    if rotated:
+        stats["rotated"] += len(rotated)
+        _notify(rotated)
+    stats["checked"] += len(rows)
+    logging.info(f"[monitor] Проверено ключей: {len(rows)}, заменено: {len(rotated)}, без замены: {len(retry)}")
+    return len(rows)
+
+async def monitor_loop():
+    while True:
+        started = time.monotonic()
+        try:
+            await check_batch(PROBES_PER_MINUTE * TICK // 60)
+        except Exception:
+            logging.exception("[monitor] Ошибка проверки ключей")
+        await asyncio.sleep(max(0, TICK - (time.monotonic() - started)))
+
+# 🔁 Ключ для «Обновить ключ»: без проверок на месте. Если по таблице здоровья сервер
+# ключа мёртв — сразу выдаём замену из пула, иначе возвращаем текущий
+async def current_key(user_id):
+    user = await adb.get_user(user_id)
+    if not user or not user.user_key:
+        return None
+    ep = parse_link(user.user_key)
+    if not user.is_active or ep is None:
+        return user.user_key
+    health = (await adb.get_endpoint_health([endpoint_key(ep.address)])).get(endpoint_key(ep.address))
+    if health and not health[0]:
+        new_key = await adb.rotate_key(user_id, user.user_key, pool.fresh_after())
+        if new_key:
+            stats["rotated"] += 1
+            return new_key
+        pool.wake()
+    return user.user_key
@@ -0,0 +1,184 @@
+import asyncio
+import itertools
+import logging
+import time
+
+from aiogram.exceptions import TelegramForbiddenError, TelegramRetryAfter
+
+import adb
+import metrics
+import workers
+
+# 📤 Очередь исходящих сообщений с ограничением скорости
+GLOBAL_RATE = 25          # сообщений в секунду на весь бот (лимит Telegram ~30)
+CHAT_RATE = 1             # сообщений в секунду в один чат
+CHAT_BURST = 3
+WORKERS = 4
+MAX_RETRIES = 3
+DIGEST_INTERVAL = 60      # как часто слать админу сводку, сек
+BROADCAST_WINDOW = 500    # сколько сообщений рассылки держать в очереди одновременно
+
+URGENT, NORMAL, BULK = 0, 1, 2
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    # Сколько ждать до следующего токена (0 — токен взят)
+    def reserve(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        return 0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    # Никаких токенов ещё seconds секунд (Telegram ответил RetryAfter)
+    def pause(self, seconds):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.tokens = min(self.tokens, 0) - seconds * self.rate
+        self.updated = now
+
+_bot = None
+_admin_id = None
+_queue = None
+_seq = itertools.count()
+_global_bucket = TokenBucket(GLOBAL_RATE, GLOBAL_RATE)
+_chat_buckets = {}
+_chat_locks = {}          # chat_id -> [Lock, сколько сообщений в работе] — порядок внутри чата
+_digest = []              # [(kind, text, amount)] с прошлой сводки
+stats = {"sent": 0, "retried": 0, "failed": 0}
+
+@metrics.register_collector
+def _collect():
+    rows = [(f"bot_outbox_{name}_total", {}, value) for name, value in stats.items()]
+    rows.append(("bot_outbox_queue_size", {}, _queue.qsize() if _queue else 0))
+    rows.append(("bot_admin_digest_pending", {}, len(_digest)))
+    return rows
+
+def _get_queue():
+    global _queue
+    if _queue is None:
+        _queue = asyncio.PriorityQueue()
+    return _queue
+
+# ✉️ Поставить сообщение в очередь (не ждёт отправки). В воркере — в очередь главного
+# процесса: лимиты Telegram общие на бота, поэтому отправляет только он
+def send(chat_id, text, priority=NORMAL, **kwargs):
+    if workers.is_worker():
+        workers.to_main("send", chat_id, text, priority, kwargs)
+        return
+    _get_queue().put_nowait((priority, next(_seq), chat_id, text, kwargs))
+
+async def _wait_rate(chat_id):
+    bucket = _chat_buckets.get(chat_id)
+    if bucket is None:
+        bucket = _chat_buckets[chat_id] = TokenBucket(CHAT_RATE, CHAT_BURST)
+    delay = max(bucket.reserve(), _global_bucket.reserve())
+    if delay:
+        await asyncio.sleep(delay)
+
+async def _deliver(chat_id, text, kwargs):
+    for attempt in range(MAX_RETRIES + 1):
+        await _wait_rate(chat_id)
+        try:
+            await _bot.send_message(chat_id, text, **kwargs)
+            stats["sent"] += 1
+            return
+        except TelegramRetryAfter as e:
+            stats["retried"] += 1
+            logging.warning(f"[outbox] Flood limit, ждём {e.retry_after} сек")
+            # лимит на весь бот: ждут все отправители, а не только этот
+            _global_bucket.pause(e.retry_after)
+        except TelegramForbiddenError:
+            break
+        except Exception:
+            logging.exception(f"[outbox] Не удалось отправить сообщение в {chat_id}")
+            break
+    stats["failed"] += 1
+
+# Сообщения одного чата отправляются по очереди: замок берётся сразу после get(),
+# без await между ними, поэтому очерёдность захвата совпадает с очерёдностью в очереди
+async def _worker():
+    queue = _get_queue()
+    while True:
+        _, _, chat_id, text, kwargs = await queue.get()
+        entry = _chat_locks.get(chat_id)
+        if entry is None:
+            entry = _chat_locks[chat_id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                await _deliver(chat_id, text, kwargs)
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del _chat_locks[chat_id]
+            queue.task_done()
+        if len(_chat_buckets) > 10000:
+            _chat_buckets.clear()
+
+# 📬 Событие для админа: копится (в главном процессе) и уходит сводкой раз в DIGEST_INTERVAL
+def notify_admin(kind, text, amount=0):
+    if workers.is_worker():
+        workers.to_main("notify", kind, text, amount)
+        return
+    _digest.append((kind, text, amount))
+
+def _digest_text(events):
+    if len(events) == 1:
+        return events[0][1]
+    signups = sum(1 for kind, *_ in events if kind == "signup")
+    payments = [amount for kind, _, amount in events if kind == "payment"]
+    rotations = sum(amount for kind, _, amount in events if kind == "rotation")
+    parts = []
+    if signups:
+        parts.append(f"+{signups} новых пользователей")
+    if payments:
+        parts.append(f"{len(payments)} оплат на {sum(payments)}₽")
+    if rotations:
+        parts.append(f"заменено {rotations} мёртвых ключей")
+    return f"📬 За {DIGEST_INTERVAL // 60} мин: " + ", ".join(parts)
+
+async def _digest_loop():
+    while True:
+        await asyncio.sleep(DIGEST_INTERVAL)
+        if _digest and _admin_id:
+            events = _digest[:]
+            _digest.clear()
+            send(_admin_id, _digest_text(events), priority=URGENT)
+
+# 📢 Рассылка всем пользователям с максимальной допустимой скоростью.
+# report_to — кому написать, сколько сообщений поставлено в очередь
+async def broadcast(text, report_to=None):
+    if workers.is_worker():
+        workers.to_main("broadcast", text, report_to)
+        return None
+    queue = _get_queue()
+    count = 0
+    after_id = 0
+    while True:
+        user_ids = await adb.list_user_ids(after_id, 1000)
+        if not user_ids:
+            break
+        for user_id in user_ids:
+            while queue.qsize() >= BROADCAST_WINDOW:
+                await asyncio.sleep(1)
+            send(user_id, text, priority=BULK)
+            count += 1
+        after_id = user_ids[-1]
+    if report_to:
+        send(report_to, f"📢 Рассылка поставлена в очередь: {count} пользователей")
+    return count
+
+def start(bot, admin_id):
+    global _bot, _admin_id
+    _bot, _admin_id = bot, admin_id
+    tasks = [asyncio.create_task(_worker()) for _ in range(WORKERS)]
+    tasks.append(asyncio.create_task(_digest_loop()))
+    return tasks
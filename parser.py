@@ -1,9 +1,14 @@
 import re
+import html
+import json
 import requests
 import base64
 import socket
+from urllib.parse import urlsplit, parse_qs, unquote
 from bs4 import BeautifulSoup
 
+import metrics
+
 # ⏱ Таймаут соединения при проверке ключа
 TIMEOUT = 3
 
@@ -17,12 +22,96 @@ SOURCES = [
 
 # 🧠 Вспомогательная функция: извлекает vmess/vless ссылки
 def extract_links(text):
-    pattern = r'(vmess|vless)://[a-zA-Z0-9+/=]+'
-    return re.findall(pattern, text)
+    pattern = r'(?:vmess|vless)://[^\s"\'<>`]+'
+    return [html.unescape(link) for link in re.findall(pattern, text)]
+
+# 📦 Разобранная ссылка: протокол, сервер, порт, id и транспорт
+class Endpoint:
+    __slots__ = ("protocol", "host", "port", "id", "transport", "link")
+
+    def __init__(self, protocol, host, port, id, transport, link):
+        self.protocol = protocol
+        self.host = host
+        self.port = port
+        self.id = id
+        self.transport = transport
+        self.link = link
+
+    # Один и тот же сервер с разными названиями/паддингом — одна identity
+    @property
+    def identity(self):
+        return self.protocol, self.host.lower(), self.port, self.id
+
+    @property
+    def address(self):
+        return self.host, self.port
+
+    def __repr__(self):
+        return f"Endpoint({self.protocol}://{self.host}:{self.port} {self.transport})"
+
+def _b64decode(raw):
+    raw = raw.strip().replace("-", "+").replace("_", "/")
+    return base64.b64decode(raw + "=" * (-len(raw) % 4)).decode("utf-8", errors="ignore")
+
+# vmess://base64(JSON) — стандартный формат v2rayN
+def _parse_vmess(link):
+    decoded = _b64decode(link[len("vmess://"):].split("#")[0].split("?")[0])
+    try:
+        data = json.loads(decoded)
+    except ValueError:
+        # старый формат: method:id@host:port
+        m = re.match(r'[^:]*:([^@]+)@([^:]+):(\d+)', decoded)
+        if not m:
+            return None
+        return Endpoint("vmess", m.group(2), int(m.group(3)), m.group(1), "tcp", link)
+    host = str(data.get("add") or "").strip()
+    port = str(data.get("port") or "").strip()
+    if not host or not port.isdigit():
+        return None
+    return Endpoint("vmess", host, int(port), str(data.get("id") or ""), data.get("net") or "tcp", link)
+
+# vless://id@host:port?type=ws&security=tls#название — обычный URI, без base64
+def _parse_vless(link):
+    url = urlsplit(link)
+    try:
+        port = url.port
+    except ValueError:
+        return None
+    if not url.hostname or not port:
+        return None
+    transport = parse_qs(url.query).get("type", ["tcp"])[0]
+    return Endpoint("vless", url.hostname, port, unquote(url.username or ""), transport, link)
+
+# 🔎 Ссылка → Endpoint или None
+def parse_link(link):
+    try:
+        if link.startswith("vmess://"):
+            return _parse_vmess(link)
+        if link.startswith("vless://"):
+            return _parse_vless(link)
+    except Exception:
+        pass
+    return None
+
+# 🧹 Дедупликация по identity; страницы можно скармливать по мере загрузки
+class EndpointDeduper:
+    def __init__(self):
+        self.seen = set()
+
+    # Новые (ещё не встречавшиеся) endpoint'ы со страницы
+    def feed(self, text):
+        new = []
+        for link in extract_links(text):
+            ep = parse_link(link)
+            if ep and ep.identity not in self.seen:
+                self.seen.add(ep.identity)
+                new.append(ep)
+        return new
 
 # 🌐 Парсинг всех источников
 def get_v2_keys():
-    keys = set()
+    keys = []
+    dedupe = EndpointDeduper()
 
     headers = {
         "User-Agent": "Mozilla/5.0"
@@ -30,37 +119,30 @@ def get_v2_keys():
 
     for url in SOURCES:
         try:
-            r = requests.get(url, headers=headers, timeout=5)
-            text = r.text
-            links = extract_links(text)
-            keys.update(links)
+            with metrics.timed("bot_fetch_seconds", source=url, status="sync"):
+                r = requests.get(url, headers=headers, timeout=5)
+            keys.extend(ep.link for ep in dedupe.feed(r.text))
         except Exception as e:
             print(f"Ошибка при получении ключей с {url}: {e}")
             continue
 
     print(f"[parser] Получено ссыл: {len(keys)}")
-    return list(keys)
+    return keys
+
+# 📍 Извлекает адрес и порт сервера из ссылки
+def parse_endpoint(link):
+    ep = parse_link(link)
+    return ep.address if ep else None
 
 # 🔍 Проверка работоспособности V2 ключа (по IP/порту)
+@metrics.timed_func("bot_probe_seconds", result="sync")
 def validate_v2_key(link):
+    endpoint = parse_endpoint(link)
+    if not endpoint:
+        return False
     try:
-        raw = link.split("://")[1]
-        decoded = base64.b64decode(raw + "===").decode("utf-8", errors="ignore")
-
-        # Пробуем извлечь адрес и порт
-        if "add" in decoded and "port" in decoded:
-            addr = re.search(r'"add"\s*:\s*"([^"]+)"', decoded)
-            port = re.search(r'"port"\s*:\s*"?(\\d+|\d+)"?', decoded)
-        else:
-            addr = re.search(r'address\s*:\s*([^,\n]+)', decoded)
-            port = re.search(r'port\s*:\s*(\d+)', decoded)
-
-        if addr and port:
-            host = addr.group(1).strip()
-            port = int(port.group(1).strip())
-
-            with socket.create_connection((host, port), timeout=TIMEOUT):
-                return True
+        with socket.create_connection(endpoint, timeout=TIMEOUT):
+            return True
     except Exception:
         pass
     return False
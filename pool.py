@@ -0,0 +1,116 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+
+import adb
+import fetcher
+from parser import EndpointDeduper
+import throttle
+import validator
+from validator import validate_many
+import workers
+
+# 🔋 Пул заранее проверенных ключей в таблице keys
+POOL_LOW = 5            # ниже этого — пополняем
+POOL_HIGH = 20          # пополняем до этого размера
+REFILL_INTERVAL = 300   # как часто проверять пул, сек
+KEY_TTL = 6 * 3600      # сколько ключ считается свежим, сек
+REFILL_WAIT = 30        # воркер: сколько ждать пополнения от главного процесса, сек
+
+_wakeup = asyncio.Event()
+
+# Разбудить сборщик раньше REFILL_INTERVAL (пул опустел). Сборщик живёт в главном процессе
+def wake():
+    if workers.is_worker():
+        workers.to_main("wake")
+    else:
+        _wakeup.set()
+
+def fresh_after():
+    return (datetime.now() - timedelta(seconds=KEY_TTL)).strftime("%Y-%m-%d %H:%M:%S")
+
+# 🧪 Сбор и проверка ключей: самые быстрые limit штук из тех, которых ещё нет в таблице keys
+# (в пуле или уже выданных). Уникальные серверы каждой страницы уходят на проверку сразу,
+# как страница загрузилась.
+async def harvest(limit):
+    dedupe = EndpointDeduper()
+    checks = []
+    async for page in fetcher.iter_pages():
+        endpoints = dedupe.feed(page)
+        if endpoints:
+            checks.append(asyncio.create_task(validate_many(endpoints)))
+    results = [r for batch in await asyncio.gather(*checks) for r in batch]
+    known = await adb.existing_keys(link for link, _ in results)
+    results = [r for r in results if r[0] not in known]
+    results.sort(key=lambda r: r[1])
+    return results[:limit]
+
+# ♻️ Один проход: выкидываем протухшие ключи и добиваем пул до POOL_HIGH
+async def refill():
+    expired = await adb.expire_pool_keys(fresh_after())
+    size = (await adb.get_pool_stats())[0]
+    if size >= POOL_LOW:
+        return 0
+    keys = await harvest(POOL_HIGH - size)
+    added = await adb.add_keys(keys)
+    logging.info(f"[pool] Удалено протухших: {expired}, добавлено: {added}, было: {size}")
+    return added
+
+# Воркер сам не собирает: ждёт, пока главный процесс положит в пул хоть один ключ
+async def _wait_for_keys():
+    deadline = time.monotonic() + REFILL_WAIT
+    while time.monotonic() < deadline and not (await adb.get_pool_stats())[0]:
+        await asyncio.sleep(1)
+
+# Общий на всех проход: фоновый цикл и ждущие пользователи не запускают сбор параллельно.
+# В воркере — будим сборщик главного процесса и ждём его результата
+async def refill_shared():
+    if workers.is_worker():
+        wake()
+        return await throttle.coalesce("pool:refill", _wait_for_keys)
+    return await throttle.coalesce("pool:refill", refill)
+
+async def harvester_loop():
+    while True:
+        # сбрасываем до прохода: wake() во время долгого сбора не потеряется
+        _wakeup.clear()
+        try:
+            await refill_shared()
+        except Exception:
+            logging.exception("[pool] Ошибка пополнения пула")
+        try:
+            await asyncio.wait_for(_wakeup.wait(), REFILL_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+
+# 🔑 Выдать ключ из пула (один запрос к БД, без парсинга).
+# wait=True — если пул пуст, дождаться общего пополнения и попробовать ещё раз
+async def claim_key(wait=False):
+    key = await adb.get_active_key(fresh_after())
+    if key is None and wait:
+        await refill_shared()
+        key = await adb.get_active_key(fresh_after())
+    if key is None or (await adb.get_pool_stats())[0] < POOL_LOW:
+        wake()
+    return key
+
+# 📊 Для админа: размер пула и возраст ключей
+async def pool_info():
+    size, oldest, newest = await adb.get_pool_stats()
+    now = datetime.now()
+
+    def age(ts):
+        if not ts:
+            return "-"
+        minutes = int((now - datetime.strptime(ts, "%Y-%m-%d %H:%M:%S")).total_seconds() // 60)
+        return f"{minutes} мин"
+
+    return (
+        f"<b>🔋 Пул ключей:</b>\n"
+        f"🔑 Свободных: {size} (мин. {POOL_LOW}, макс. {POOL_HIGH})\n"
+        f"⏳ Самый старый: {age(oldest)}\n"
+        f"🆕 Самый свежий: {age(newest)}\n"
+        f"🗑 Срок жизни: {KEY_TTL // 60} мин\n"
+        f"{validator.health_summary()}"
+    )
@@ -0,0 +1,58 @@
+from datetime import datetime, timedelta
+
+import adb
+import db
+
+# 📊 Статистика для админа: итоги по пользователям одним запросом + дневные счётчики
+
+TARIFF_NAMES = {30: "1 месяц", 90: "3 месяца", 365: "12 месяцев"}
+SIGNUP_DAYS = 7   # за сколько дней показывать регистрации по дням
+
+def _day(days_ago):
+    return (datetime.today() - timedelta(days=days_ago)).strftime("%Y-%m-%d")
+
+# 💰 Выручка за периоды из дневных счётчиков: {название: сумма}
+def _revenue_by_period(rows):
+    periods = {"Сегодня": _day(0), "7 дней": _day(6), "30 дней": _day(29)}
+    return {
+        name: sum(value for day, metric, value in rows if metric == "revenue" and day >= since)
+        for name, since in periods.items()
+    }
+
+async def build_report():
+    total, active, keys_issued, total_balance = await adb.get_user_totals()
+    avg_balance = total_balance // total if total else 0
+    rows = await adb.get_daily_stats(_day(29))
+    totals = await adb.get_stats_totals()
+    cached, hits, misses = db.cache_stats()
+
+    text = (
+        f"<b>📊 Статистика:</b>\n"
+        f"👥 Всего пользователей: {total}\n"
+        f"✅ Активных: {active}\n"
+        f"🔑 С ключами: {keys_issued}\n"
+        f"💰 Общий баланс: {total_balance}₽\n"
+        f"📈 Средний баланс: {avg_balance}₽\n"
+    )
+
+    text += "\n<b>💸 Выручка:</b>\n"
+    for name, value in _revenue_by_period(rows).items():
+        text += f"{name}: {value}₽\n"
+    text += f"Всего: {totals.get('revenue', 0)}₽ ({totals.get('payments', 0)} оплат)\n"
+
+    tariffs = sorted(
+        (int(metric.split(":")[1]), value) for metric, value in totals.items() if metric.startswith("revenue:")
+    )
+    if tariffs:
+        text += "\n<b>🧾 По тарифам:</b>\n"
+        for days, value in tariffs:
+            text += f"{TARIFF_NAMES.get(days, f'{days} дней')}: {value}₽\n"
+
+    signups = {day: value for day, metric, value in rows if metric == "signups"}
+    text += "\n<b>🆕 Регистрации:</b>\n"
+    for days_ago in range(SIGNUP_DAYS - 1, -1, -1):
+        day = _day(days_ago)
+        text += f"{day}: {signups.get(day, 0)}\n"
+
+    text += f"\n🗃 Кэш пользователей: {cached} шт., попаданий {hits}, промахов {misses}"
+    return text
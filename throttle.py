@@ -0,0 +1,90 @@
+import asyncio
+import time
+
+from aiogram import BaseMiddleware
+
+import metrics
+from outbox import TokenBucket
+
+# 🚦 Защита дорогих кнопок: одна общая работа на всех, лимиты на пользователя и хендлер
+USER_RATE = 1             # нажатий в секунду на пользователя
+USER_BURST = 5
+DEBOUNCE = 1.0            # повтор той же кнопки раньше этого — игнорируем, сек
+HANDLER_LIMITS = {        # сколько одновременно выполняется хендлер, остальные ждут
+    "install_v2": 8,
+    "pool_info_cb": 1,
+}
+
+_inflight = {}            # ключ -> задача, которую ждут все вызывающие
+_user_buckets = {}
+_last_press = {}          # (user_id, data) -> когда кнопка отработала последний раз
+_running = set()          # (user_id, data), которые выполняются прямо сейчас
+_semaphores = {}
+stats = {"coalesced": 0, "debounced": 0, "throttled": 0, "queued": 0}
+
+@metrics.register_collector
+def _collect():
+    rows = [(f"bot_throttle_{name}_total", {}, value) for name, value in stats.items()]
+    rows.append(("bot_singleflight_inflight", {}, len(_inflight)))
+    return rows
+
+# 🤝 Single-flight: пока работа по ключу идёт, новые вызовы ждут её же результат.
+# Отмена одного ожидающего не отменяет общую задачу.
+async def coalesce(key, func, *args):
+    task = _inflight.get(key)
+    if task is None:
+        task = _inflight[key] = asyncio.ensure_future(func(*args))
+        task.add_done_callback(lambda _: _inflight.pop(key, None))
+    else:
+        stats["coalesced"] += 1
+    return await asyncio.shield(task)
+
+def _semaphore(name):
+    sem = _semaphores.get(name)
+    if sem is None and name in HANDLER_LIMITS:
+        sem = _semaphores[name] = asyncio.Semaphore(HANDLER_LIMITS[name])
+    return sem
+
+def _take_token(user_id):
+    bucket = _user_buckets.get(user_id)
+    if bucket is None:
+        bucket = _user_buckets[user_id] = TokenBucket(USER_RATE, USER_BURST)
+    if bucket.reserve():
+        bucket.tokens += 1  # отказ не должен копить долг
+        return False
+    return True
+
+# 🧭 Middleware для callback-кнопок: debounce повторов, лимит нажатий и очередь на хендлер.
+# Регистрируется до HandlerTimingMiddleware, чтобы отброшенные нажатия не попадали в замеры.
+class ThrottleMiddleware(BaseMiddleware):
+    async def __call__(self, handler, event, data):
+        user_id = event.from_user.id
+        press = (user_id, event.data)
+        now = time.monotonic()
+
+        if press in _running or now - _last_press.get(press, -DEBOUNCE) < DEBOUNCE:
+            stats["debounced"] += 1
+            await event.answer("⏳ Уже выполняется…")
+            return
+        if not _take_token(user_id):
+            stats["throttled"] += 1
+            await event.answer("🐢 Слишком часто, подожди пару секунд")
+            return
+
+        name = getattr(getattr(data.get("handler"), "callback", None), "__name__", "")
+        sem = _semaphore(name)
+        _running.add(press)
+        try:
+            if sem is None:
+                return await handler(event, data)
+            if sem.locked():
+                stats["queued"] += 1
+                await event.answer("⏳ Много запросов, ты в очереди…")
+            async with sem:
+                return await handler(event, data)
+        finally:
+            _running.discard(press)
+            _last_press[press] = time.monotonic()
+            if len(_last_press) > 10000:
+                _last_press.clear()
+                _user_buckets.clear()
@@ -0,0 +1,116 @@
+import asyncio
+import logging
+import time
+
+import adb
+import metrics
+from parser import TIMEOUT, Endpoint, parse_link
+
+# ⚡ Параллельная проверка ключей через asyncio
+CONCURRENCY = 256        # одновременных TCP-подключений
+DEADLINE = TIMEOUT * 2   # общий лимит на всю пачку, сек
+
+# 🔌 Пробуем подключиться, возвращаем задержку в мс (None — не отвечает)
+async def probe(host, port, timeout=TIMEOUT):
+    started = time.perf_counter()
+    try:
+        _, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+    except Exception:
+        metrics.observe("bot_probe_seconds", time.perf_counter() - started, result="dead")
+        return None
+    metrics.observe("bot_probe_seconds", time.perf_counter() - started, result="ok")
+    latency = round((time.perf_counter() - started) * 1000, 1)
+    writer.close()
+    try:
+        await writer.wait_closed()
+    except Exception:
+        pass
+    return latency
+
+# 🩺 Кэш здоровья серверов (таблица endpoint_health)
+HEALTHY_TTL = 15 * 60        # живой сервер не перепроверяем столько, сек
+DEAD_TTL = 10 * 60           # мёртвый — первая пауза, дальше удваивается
+DEAD_TTL_MAX = 24 * 3600
+
+stats = {"lookups": 0, "hits": 0, "probes": 0, "alive": 0}
+
+def endpoint_key(address):
+    return f"{address[0]}:{address[1]}"
+
+def _next_probe(now, latency, failures):
+    if latency is not None:
+        return now + HEALTHY_TTL
+    return now + min(DEAD_TTL_MAX, DEAD_TTL * 2 ** (failures - 1))
+
+@metrics.register_collector
+def _collect():
+    return [(f"bot_endpoint_{name}_total", {}, value) for name, value in stats.items()]
+
+def health_summary():
+    hit_rate = stats["hits"] * 100 // stats["lookups"] if stats["lookups"] else 0
+    return (
+        f"🩺 Проверки серверов: {stats['probes']} (живых {stats['alive']}), "
+        f"из кэша {stats['hits']}/{stats['lookups']} ({hit_rate}%)"
+    )
+
+# 🧪 Проверяет пачку ссылок или Endpoint'ов: один probe на host:port,
+# свежие результаты берутся из кэша здоровья (use_cache=False — проверить всё заново).
+# Результат — [(link, latency)] от быстрых к медленным
+@metrics.timed_func("bot_validate_seconds")
+async def validate_many(links, concurrency=CONCURRENCY, timeout=TIMEOUT, deadline=DEADLINE, use_cache=True):
+    by_endpoint = {}
+    for link in links:
+        ep = link if isinstance(link, Endpoint) else parse_link(link)
+        if ep:
+            by_endpoint.setdefault(ep.address, []).append(ep.link)
+    if not by_endpoint:
+        return []
+
+    now = time.time()
+    health = await adb.get_endpoint_health(endpoint_key(a) for a in by_endpoint) if use_cache else {}
+    latencies = {}
+    to_probe = []
+    for address in by_endpoint:
+        cached = health.get(endpoint_key(address))
+        if cached and now < cached[3]:
+            latencies[address] = cached[1] if cached[0] else None
+        else:
+            to_probe.append(address)
+    stats["lookups"] += len(by_endpoint)
+    stats["hits"] += len(latencies)
+
+    sem = asyncio.Semaphore(concurrency)
+
+    async def check(address):
+        async with sem:
+            return address, await probe(*address, timeout=timeout)
+
+    pending = ()
+    if to_probe:
+        tasks = [asyncio.create_task(check(a)) for a in to_probe]
+        done, pending = await asyncio.wait(tasks, timeout=deadline)
+        for t in pending:
+            t.cancel()
+
+        rows = []
+        now = time.time()
+        for t in done:
+            address, latency = t.result()
+            latencies[address] = latency
+            key = endpoint_key(address)
+            failures = 0 if latency is not None else (health.get(key, (0, 0, 0))[2] or 0) + 1
+            rows.append((key, latency is not None, latency, now, failures, _next_probe(now, latency, failures)))
+        stats["probes"] += len(rows)
+        stats["alive"] += sum(1 for r in rows if r[1])
+        await adb.save_endpoint_health(rows)
+
+    results = []
+    for address, latency in latencies.items():
+        if latency is not None:
+            results.extend((link, latency) for link in by_endpoint[address])
+    results.sort(key=lambda r: r[1])
+    logging.info(
+        f"[validator] Ссылок: {len(links)}, серверов: {len(by_endpoint)}, из кэша: {len(by_endpoint) - len(to_probe)}, "
+        f"живых: {len(results)}, не успели: {len(pending)}"
+    )
+    return results
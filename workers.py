@@ -0,0 +1,157 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+
+from aiogram import BaseMiddleware
+
+import db
+
+# 🧩 Режим нескольких процессов: главный процесс принимает апдейты (polling или вебхук)
+# и раздаёт их воркерам по user_id % WORKERS — действия одного пользователя всегда
+# обрабатывает один процесс и по порядку. Фоновые циклы работают только в главном.
+WORKERS = int(os.getenv("WORKERS", "1"))
+CACHE_TTL = 5            # сек: кэш пользователей не сбрасывается записями других процессов
+SUPERVISE_INTERVAL = 5   # как часто проверять, живы ли воркеры, сек
+METRICS_INTERVAL = 5     # как часто воркер отправляет свои метрики главному, сек
+
+_ctx = multiprocessing.get_context("spawn")
+_events = None           # в воркере: очередь событий для главного процесса
+
+# Код выполняется в воркере (а не в главном процессе или без воркеров)
+def is_worker():
+    return _events is not None
+
+# 📨 Из воркера в главный процесс: ("send", ...), ("notify", ...), ("broadcast", ...),
+# ("wake",) — пул опустел, ("metrics", index, snapshot) — метрики воркера для /metrics
+def to_main(kind, *args):
+    _events.put((kind, args))
+
+# Главный процесс: выполняет события воркеров — всё исходящее идёт через одну очередь outbox
+async def _relay(events):
+    import metrics
+    import outbox
+    import pool
+
+    loop = asyncio.get_running_loop()
+    while True:
+        event = await loop.run_in_executor(None, events.get)
+        if event is None:
+            break
+        kind, args = event
+        try:
+            if kind == "send":
+                chat_id, text, priority, kwargs = args
+                outbox.send(chat_id, text, priority, **kwargs)
+            elif kind == "notify":
+                outbox.notify_admin(*args)
+            elif kind == "broadcast":
+                asyncio.create_task(outbox.broadcast(*args))
+            elif kind == "wake":
+                pool.wake()
+            elif kind == "metrics":
+                metrics.merge_remote(*args)
+        except Exception:
+            logging.exception(f"[workers] Ошибка события {kind}")
+
+def route(update, user):
+    if user is not None:
+        return user.id
+    chat = getattr(update.event, "chat", None)
+    return chat.id if chat is not None else 0
+
+# 📮 Outer-middleware главного процесса: вместо обработки кладёт апдейт в очередь воркера
+class RouteMiddleware(BaseMiddleware):
+    def __init__(self, queues):
+        self.queues = queues
+
+    async def __call__(self, handler, event, data):
+        key = route(event, data.get("event_from_user"))
+        self.queues[key % len(self.queues)].put((key, event.model_dump_json(exclude_unset=True)))
+
+# 👷 Воркер: свой Bot, Dispatcher и поток записи в БД; исходящие уходят в главный процесс
+def _worker_main(index, jobs, events):
+    global _events
+    _events = events
+    logging.basicConfig(level=logging.INFO, format=f"[worker {index}] %(levelname)s %(name)s: %(message)s")
+    asyncio.run(_serve(index, jobs))
+
+async def _report_metrics(index):
+    import metrics
+
+    while True:
+        await asyncio.sleep(METRICS_INTERVAL)
+        to_main("metrics", index, metrics.snapshot())
+
+async def _serve(index, jobs):
+    db.CACHE_TTL = CACHE_TTL
+
+    from aiogram.types import Update
+    import adb
+    import main
+    import metrics
+
+    loop = asyncio.get_running_loop()
+    reporter = asyncio.create_task(_report_metrics(index))
+    tails = {}  # user_id -> последняя задача пользователя
+
+    async def handle(key, update, prev):
+        if prev is not None:
+            await asyncio.wait({prev})
+        try:
+            await main.dp.feed_update(main.bot, update)
+        except Exception:
+            logging.exception("Ошибка обработки апдейта")
+        finally:
+            if tails.get(key) is asyncio.current_task():
+                del tails[key]
+
+    while True:
+        job = await loop.run_in_executor(None, jobs.get)
+        if job is None:
+            break
+        key, raw = job
+        update = Update.model_validate_json(raw, context={"bot": main.bot})
+        tails[key] = asyncio.create_task(handle(key, update, tails.get(key)))
+
+    if tails:
+        await asyncio.wait(list(tails.values()))
+    reporter.cancel()
+    to_main("metrics", index, metrics.snapshot())
+    await main.bot.session.close()
+    adb.stop()
+
+def _spawn(index, jobs, events):
+    proc = _ctx.Process(target=_worker_main, args=(index, jobs, events), name=f"bot-worker-{index}", daemon=True)
+    proc.start()
+    return proc
+
+# 🚀 Запускает воркеры и вешает маршрутизацию на диспетчер главного процесса.
+# Упавший воркер перезапускается с той же очередью — новые апдейты его дождутся.
+async def start(dp, count=WORKERS):
+    db.CACHE_TTL = CACHE_TTL
+    queues = [_ctx.Queue() for _ in range(count)]
+    events = _ctx.Queue()
+    procs = [_spawn(i, q, events) for i, q in enumerate(queues)]
+    dp.update.outer_middleware(RouteMiddleware(queues))
+    relay = asyncio.create_task(_relay(events))
+
+    async def supervise():
+        while True:
+            await asyncio.sleep(SUPERVISE_INTERVAL)
+            for i, proc in enumerate(procs):
+                if not proc.is_alive():
+                    logging.warning(f"[workers] Воркер {i} завершился (код {proc.exitcode}), перезапускаем")
+                    procs[i] = _spawn(i, queues[i], events)
+
+    task = asyncio.create_task(supervise())
+
+    def stop():
+        task.cancel()
+        for q in queues:
+            q.put(None)
+        for proc in procs:
+            proc.join(10)
+        events.put(None)
+        relay.cancel()
+    return stop